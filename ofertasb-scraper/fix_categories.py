@@ -2,9 +2,9 @@
 Script para verificar y arreglar problemas con categorías faltantes en Supabase
 """
 import os
-from datetime import datetime
 from supabase import create_client
 from dotenv import load_dotenv
+from utils.dates import utc_now_iso
 
 # Cargar variables de entorno
 load_dotenv()
@@ -48,7 +48,7 @@ def fix_categories():
                 "external_id": "199",
                 "name": "Accesorios para celular",
                 "source_url": "https://www.ofertasb.com/productos_cat.asp?id=199",
-                "last_crawled_at": datetime.utcnow().isoformat(),
+                "last_crawled_at": utc_now_iso(),
                 "seller_id": 1
             }
             
@@ -1,18 +1,26 @@
 import argparse
-import hashlib
+import asyncio
 import os
-import time
-from typing import Dict, List, Optional
+import re
+import sqlite3
+from typing import Dict, List, Optional, Tuple
 import httpx
-from bs4 import BeautifulSoup
-from datetime import datetime
+import hishel
+from selectolax.lexbor import LexborHTMLParser, LexborNode
 from tenacity import retry, stop_after_attempt, wait_exponential
+from pathlib import Path
 from urllib.parse import urljoin
+import xxhash
 import tqdm  # Asegúrate de tener tqdm instalado para la barra de progreso
 import logging
+import logging.handlers
+import queue
+import atexit
 
 from supabase_client import SupabaseClient
 from utils.price import parse_price
+from utils.rate_limit import RateLimiter
+from utils.dates import utc_now_iso
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,54 +29,267 @@ BASE_URL = "https://www.ofertasb.com"
 HEADERS = {
     "User-Agent": f"OfertasBScraper/1.0 (Contact: {os.getenv('CONTACT_EMAIL')})"
 }
+UPSERT_BATCH_SIZE = 500  # Productos por llamada de upsert a Supabase
+MAX_CONCURRENT_REQUESTS = 16  # Solicitudes simultáneas permitidas contra OfertasB
+MAX_REQUESTS_PER_SECOND = 8  # Ritmo máximo de solicitudes contra OfertasB
+IMAGE_CACHE_PATH = 'image_cache.sqlite'  # Imágenes de alta calidad ya resueltas, entre ejecuciones
+HTTP_CACHE_PATH = '.httpcache'  # Respuestas guardadas para revalidarlas con GET condicionales
+HTTP_CACHE_TTL = 3 * 24 * 60 * 60  # Segundos que se conserva cada respuesta en HTTP_CACHE_PATH antes de borrarla
+HTTP_CACHE_CHECK_EVERY = 10 * 60  # Cada cuántos segundos se buscan respuestas vencidas para borrarlas
+PAGE_CACHE_PATH = 'page_cache.sqlite'  # Hash del HTML de los listados que ya estaban al día en Supabase
+PRODUCT_TABLE_SELECTOR = 'table#customers[width="200"]'  # Tablas de las tarjetas de producto
+CATEGORY_LINK_SELECTOR = "a[href*='productos_cat.asp']"  # Enlaces a listados de categoría
+CATEGORY_PAGE_LINK_SELECTOR = "a[href*='productos_cat.asp?id={category_id}&pagina=']"  # Paginador de una categoría
+PAGINATION_RE = re.compile(r"productos_cat\.asp\?id=(\d+)&(?:amp;)?pagina=(\d+)")  # Enlaces del paginador
+PROGRESS_MININTERVAL = 0.5  # Segundos mínimos entre redibujados de las barras de productos
+PRICE_SYMBOLS = frozenset('₡¢')  # Símbolos de moneda que identifican la celda de precio
+# Etiquetas de las filas de la página de detalle del producto
+PRICE_LABEL = 'Precio.'
+ESTADO_LABEL = 'Estado'
+PESO_LABEL = 'Peso Gramos'
+CATEGORY_LABEL = 'Categoria'
+
+
+def _has_text(node: LexborNode, text: str) -> bool:
+    """Indica si algún nodo de texto descendiente es exactamente `text`."""
+    return any(
+        child.is_text_node and child.text_content == text
+        for child in node.traverse(include_text=True)
+    )
+
+
+def _absolute_url(href: str) -> str:
+    """Convierte un enlace del sitio en URL absoluta, evitando urljoin en los casos comunes."""
+    if href.startswith(('http://', 'https://')):
+        return href
+    if href.startswith('/'):
+        return f"{BASE_URL}{href}"
+    if '/' not in href and not href.startswith(('?', '#', '.')):
+        return f"{BASE_URL}/{href}"
+    return urljoin(BASE_URL, href)
+
+
+def _product_hash(name: str, price_raw: str, image: Optional[str]) -> bytes:
+    """Hash de los datos visibles del producto, usado para detectar cambios.
+    Se compara como digest de 16 bytes y se guarda en Supabase en hexadecimal."""
+    return xxhash.xxh3_128_digest(f"{name}:{price_raw}:{image}".encode('utf-8'))
+
+
+def _stored_hash(source_html_hash: Optional[str]) -> Optional[bytes]:
+    """Convierte un source_html_hash guardado en bytes (None si no es hexadecimal válido)."""
+    try:
+        return bytes.fromhex(source_html_hash)
+    except (TypeError, ValueError):
+        return None
 
-# Configurar el logger para guardar en un archivo
+
+def _max_page_number(html: str, category_id: str) -> int:
+    """Mayor número de página enlazado desde el paginador de la categoría (0 si no hay).
+    Se busca sobre el HTML crudo, sin construir el árbol del documento."""
+    return max(
+        (int(page) for cat_id, page in PAGINATION_RE.findall(html) if cat_id == category_id),
+        default=0
+    )
+
+
+def _find_product_tables(tree: LexborHTMLParser) -> List[LexborNode]:
+    """Tablas de producto de un listado: el selector CSS descarta casi todo antes de revisar filas."""
+    return [
+        table for table in tree.css(PRODUCT_TABLE_SELECTOR)
+        if table.css_first('a') is not None and table.css_first('img') is not None
+        and len(table.css('tr')) >= 3
+    ]
+
+
+def _card_cells(product_table: LexborNode) -> Tuple[Optional[LexborNode], Optional[LexborNode], Optional[LexborNode]]:
+    """Enlace, celda de nombre y celda de precio de una tarjeta, recorriendo sus filas una sola vez."""
+    rows = product_table.css('tr')
+    link = rows[0].css_first('a') if rows else None
+    name_cell = product_table.css_first('td[colspan="1"]')
+    price_cell = rows[2].css_first('td') if len(rows) >= 3 else None
+    return link, name_cell, price_cell
+
+
+def _cell_text(cell: LexborNode, strip_nodes: bool = True) -> str:
+    """Texto de una celda. Si no tiene etiquetas anidadas se leen solo sus nodos de texto
+    directos, sin recorrer descendientes; con `strip_nodes=False` el texto anidado se une sin recortar cada nodo."""
+    if next(cell.iter(), None) is None:
+        return cell.text(deep=False, strip=True)
+    return cell.text(strip=True) if strip_nodes else cell.text().strip()
+
+
+def _find_product_image(node: LexborNode) -> Optional[LexborNode]:
+    """Devuelve la primera imagen de producto (rutas con 'upload' o 'images')."""
+    for img in node.css('img'):
+        src = img.attributes.get('src')
+        if src and ('upload' in src or 'images' in src):
+            return img
+    return None
+
+
+def _parse_card(product_table: LexborNode) -> Dict:
+    """Datos visibles de una tarjeta del listado junto con su hash, sin referencias al árbol.
+    Lanza ValueError si falta el enlace, el nombre o el precio."""
+    # Obtener enlace, nombre y precio de la tarjeta en un solo recorrido
+    img_row, name_cell, price_cell = _card_cells(product_table)
+
+    # Obtener enlace del producto y extraer el ID
+    href = img_row.attributes.get('href') if img_row else None
+    if not href:
+        raise ValueError("Could not find product link")
+    product_url = _absolute_url(href)
+    try:
+        external_product_id = int(href.rpartition('id=')[2])  # Convertir a entero
+    except ValueError:
+        raise ValueError(f"Invalid external_product_id extracted from URL: {product_url}")
+
+    # Obtener imagen en miniatura como fallback
+    img_elem = img_row.css_first('img')
+    if not img_elem or not img_elem.attributes.get('src'):
+        log.warning("No thumbnail image for product %s", external_product_id)
+        list_image = None
+    else:
+        list_image = _absolute_url(img_elem.attributes['src'])
+
+    # Obtener nombre y precio desde la tabla de la categoría
+    product_name = _cell_text(name_cell) if name_cell else ''
+    if not product_name:
+        raise ValueError("Could not find product name")
+
+    price_raw = _cell_text(price_cell, strip_nodes=False) if price_cell else ''
+    if PRICE_SYMBOLS.isdisjoint(price_raw):
+        raise ValueError("Could not find price element")
+    _, price_numeric = parse_price(price_raw)
+
+    # Validar que price_numeric es válido
+    if not isinstance(price_numeric, (int, float)):
+        raise ValueError(f"Invalid price_numeric for product {external_product_id}: {price_numeric}")
+
+    return {
+        "external_product_id": external_product_id,
+        "product_url": product_url,
+        "image_url": list_image,
+        "name": product_name,
+        "price_raw": price_raw,
+        "price_numeric": float(price_numeric),
+        # Generar el hash del producto actual usando solo datos de la categoría
+        "source_html_hash": _product_hash(product_name, price_raw, list_image)
+    }
+
+# Configurar el logger para guardar en un archivo. Las llamadas solo encolan el registro;
+# un hilo aparte lo escribe en disco sin bloquear el event loop
+_log_queue = queue.SimpleQueue()
+_log_file_handler = logging.FileHandler('scraper_log.txt')
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_file_handler)
 logging.basicConfig(
-    filename='scraper_log.txt',
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    format='%(message)s',  # El formato completo lo aplica el handler de archivo
+    handlers=[logging.handlers.QueueHandler(_log_queue)]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)  # Vaciar la cola antes de salir
+log = logging.getLogger(__name__)
 
 class OfertasBScraper:
-    def __init__(self):
+    def __init__(self, fetch_details: bool = False):
         self.supabase = SupabaseClient()
-        self.session = httpx.Client(
+        # Visitar productos_full.asp por producto solo si se piden la imagen grande y los detalles
+        self.fetch_details = fetch_details
+        # Las páginas guardadas se revalidan siempre (If-None-Match / If-Modified-Since);
+        # si no cambiaron, el servidor responde 304 sin cuerpo y se usa la copia local.
+        # Esto solo ahorra la descarga: el cuerpo vuelve igual y se sigue analizando (ver _page_cache)
+        self.session = hishel.AsyncCacheClient(
+            controller=hishel.Controller(cacheable_methods=["GET"], allow_heuristics=True, always_revalidate=True),
+            # Con TTL, las respuestas de productos y páginas que ya no se piden no se acumulan entre ejecuciones
+            storage=hishel.AsyncFileStorage(
+                base_path=Path(HTTP_CACHE_PATH), ttl=HTTP_CACHE_TTL, check_ttl_every=HTTP_CACHE_CHECK_EVERY
+            ),
             timeout=30.0,
             headers=HEADERS,
-            follow_redirects=True
+            follow_redirects=True,
+            # Multiplexar las solicitudes concurrentes sobre una conexión HTTP/2 si el servidor lo admite
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONCURRENT_REQUESTS,
+                max_keepalive_connections=MAX_CONCURRENT_REQUESTS,
+                # Mantener las conexiones ociosas mientras se parsea o se escribe en Supabase
+                keepalive_expiry=60
+            )
         )
-        # Cache de productos existentes
+        # Limita cuántas solicitudes hay en vuelo a la vez para no saturar el servidor
+        self._request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self._rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+        # Cache de hashes de los productos consultados en la categoría actual (external_product_id -> digest)
         self.existing_products = {}
+        # Desplegable de categorías, que no cambia durante una ejecución
+        self._categories = None
+        self._category_options = None
+        self._category_options_by_id: Dict[str, Dict] = {}
+        # IDs internos de Supabase ya resueltos (external_id -> id)
+        self._category_ids: Dict[str, int] = {}
+        # Cache persistente external_product_id -> imagen de alta calidad (solo con fetch_details)
+        self._image_cache = None
+        if fetch_details:
+            self._image_cache = sqlite3.connect(IMAGE_CACHE_PATH)
+            self._image_cache.execute(
+                "CREATE TABLE IF NOT EXISTS images (external_product_id TEXT PRIMARY KEY, image_url TEXT NOT NULL)"
+            )
+        # Cache persistente url -> (hash del HTML, tarjetas) de listados sin productos pendientes.
+        # No repite al cache HTTP: un 304 dice que el HTML no cambió en el servidor, no que sus
+        # productos ya estén en Supabase (la ejecución anterior pudo cortarse antes del upsert), y
+        # OfertasB no siempre envía ETag/Last-Modified. Una fila aquí solo se escribe cuando todos
+        # los productos de ese mismo HTML coincidían con Supabase, y es lo que permite no parsearlo
+        self._page_cache = sqlite3.connect(PAGE_CACHE_PATH)
+        self._page_cache.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, body_hash BLOB NOT NULL, product_count INTEGER NOT NULL)"
+        )
+        # Detalles pedidos en esta ejecución (external_product_id -> tarea); las consultas
+        # simultáneas del mismo producto comparten una sola descarga
+        self._detail_tasks: Dict[int, asyncio.Task] = {}
         
-    def _load_existing_products(self, category_id: Optional[str] = None):
-        """Carga los external_product_id y source_html_hash existentes en la base de datos"""
+    def _load_existing_products(self, external_ids: List[str], hashes: Optional[List[bytes]] = None) -> Dict[str, bytes]:
+        """Consulta los source_html_hash de los productos indicados y los agrega al cache.
+        Con `hashes`, solo vuelven las filas cuyo hash guardado está entre ellos (posibles productos sin cambios)."""
+        if not external_ids:
+            return {}
         try:
-            query = self.supabase.client.table("products").select("external_product_id,source_html_hash")
-            if category_id:
-                query = query.eq("category_id", category_id)
-
-            # Establecer un límite alto para asegurarnos de obtener todos los productos
-            query = query.limit(100000)
+            # Un filtro IN acotado a la página aprovecha el índice de external_product_id
+            query = self.supabase.client.table("products").select(
+                "external_product_id,source_html_hash"
+            ).in_("external_product_id", external_ids)
+            if hashes:
+                # Los productos modificados no coinciden y no viajan en la respuesta
+                query = query.in_("source_html_hash", [product_hash.hex() for product_hash in hashes])
             result = query.execute()
 
-            # Almacenar solo los hashes como valores
-            self.existing_products = {
-                product['external_product_id']: str(product['source_html_hash'])
-                for product in result.data if product.get('source_html_hash')
-            }
-            print(f"Cargados {len(self.existing_products)} productos existentes en cache")
+            # Almacenar solo los hashes como valores, en bytes para ocupar menos memoria
+            found = {}
+            for product in result.data:
+                digest = _stored_hash(product.get('source_html_hash'))
+                if digest:
+                    found[product['external_product_id']] = digest
+            self.existing_products.update(found)
+            return found
         except Exception as e:
             print(f"Error cargando productos existentes: {str(e)}")
-            self.existing_products = {}
+            return {}
 
-    def close(self):
-        self.session.close()
+    async def close(self):
+        await self.session.aclose()
+        self._page_cache.commit()
+        self._page_cache.close()
+        if self._image_cache is not None:
+            self._image_cache.commit()
+            self._image_cache.close()
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def _fetch_page(self, url: str) -> str:
+    async def _fetch_page(self, url: str) -> str:
         """Fetch a page with retry logic"""
         try:
-            response = self.session.get(url)
+            await self._rate_limiter.acquire()
+            async with self._request_semaphore:
+                response = await self.session.get(url)
             response.raise_for_status()
             return response.text
         except httpx.HTTPStatusError as e:
@@ -77,132 +298,147 @@ class OfertasBScraper:
             print(f"Contenido de la respuesta: {response.text[:500]}...")  # Limitar el contenido para depuración
             raise e
 
-    def get_categories(self) -> List[Dict[str, str]]:
+    async def get_categories(self) -> List[Dict[str, str]]:
         """Fetch all categories from the main page"""
-        html = self._fetch_page(f"{BASE_URL}/productos_cat.asp")
-        soup = BeautifulSoup(html, 'html.parser')
+        if self._categories is not None:
+            return list(self._categories)
+
+        html = await self._fetch_page(f"{BASE_URL}/productos_cat.asp")
+        tree = LexborHTMLParser(html)
         
         categories = []
-        select = soup.find('select', {'name': 'id'})
+        select = tree.css_first('select[name="id"]')
         if not select:
             raise ValueError("Could not find category select element")
             
         print("\nEncontrando categorías disponibles...")
-        for option in select.find_all('option'):
-            if option.get('value'):
+        for option in select.css('option'):
+            value = option.attributes.get('value')
+            if value:
                 cat_data = {
-                    'external_id': option['value'],
-                    'name': option.text.strip(),
-                    'source_url': f"{BASE_URL}/productos_cat.asp?id={option['value']}"
+                    'external_id': value,
+                    'name': option.text().strip(),
+                    'source_url': f"{BASE_URL}/productos_cat.asp?id={value}"
                 }
                 categories.append(cat_data)
                 print(f"- Categoría encontrada: {cat_data['name']} (ID: {cat_data['external_id']})")
                 
         print(f"\nTotal de categorías encontradas: {len(categories)}\n")
-        return categories
+        self._categories = categories
+        return list(categories)
 
-    def fetch_categories(self) -> List[Dict]:
+    async def fetch_categories(self) -> List[Dict]:
         """Fetch all categories from the main page"""
+        if self._category_options is not None:
+            return list(self._category_options)
+
         try:
-            url = urljoin(BASE_URL, "productos_cat.asp")
-            page_content = self._fetch_page(url)
+            url = f"{BASE_URL}/productos_cat.asp"
+            page_content = await self._fetch_page(url)
             print(page_content[:500])  # Imprimir parte del contenido para depuración
-            soup = BeautifulSoup(page_content, "html.parser")
+            tree = LexborHTMLParser(page_content)
             categories = []
 
             # Buscar el elemento <select> que contiene las categorías
-            category_select = soup.find("select")  # Ajustar para buscar cualquier <select>
+            category_select = tree.css_first("select")  # Ajustar para buscar cualquier <select>
             if not category_select:
                 raise ValueError("No se encontró el formulario de categorías")
 
             # Extraer las opciones dentro del <select>
-            for option in category_select.find_all("option"):
-                if option.get("value"):
+            for option in category_select.css("option"):
+                value = option.attributes.get("value")
+                if value:
                     categories.append({
-                        "name": option.get_text(strip=True),
-                        "external_id": option["value"],
-                        "url": f"{BASE_URL}/productos_cat.asp?id={option['value']}"
+                        "name": option.text(strip=True),
+                        "external_id": value,
+                        "url": f"{BASE_URL}/productos_cat.asp?id={value}"
                     })
 
             print(f"Categorías encontradas: {len(categories)}")
-            return categories
+            self._category_options = categories
+            self._category_options_by_id = {category["external_id"]: category for category in categories}
+            return list(categories)
         except Exception as e:
             print(f"Error fetching categories: {str(e)}")
             return []
 
-    def get_category_pages(self, category_id: str) -> List[str]:
-        """Get all pagination URLs for a category"""
+    async def get_category_pages(self, category_id: str) -> Dict[str, Optional[str]]:
+        """Get all pagination URLs for a category, mapped to the HTML already downloaded for them"""
         base_url = f"{BASE_URL}/productos_cat.asp?id={category_id}"
         pages = set([base_url])  # Usamos un set para evitar duplicados
+        page_html = {}  # HTML descargado durante la búsqueda, para no volver a pedir cada página
+        # Selector y filtro de la categoría, armados una sola vez para todas las páginas
+        page_link_selector = CATEGORY_PAGE_LINK_SELECTOR.format(category_id=category_id)
+        category_marker = f"id={category_id}"
         
-        def extract_page_links(url):
+        async def extract_page_links(url):
             try:
-                html = self._fetch_page(url)
-                soup = BeautifulSoup(html, 'html.parser')
+                html = page_html.get(url) or await self._fetch_page(url)
+                page_html[url] = html
+                tree = LexborHTMLParser(html)
                 new_links = set()
                 
                 # Método 1: Buscar la tabla de paginación (la que no tiene imágenes)
                 pagination_table = None
-                for table in soup.find_all('table', id='customers'):
-                    if not table.find('img'):
+                for table in tree.css('table#customers'):
+                    if not table.css_first('img'):
                         pagination_table = table
                         break
                 
                 if pagination_table:
-                    for link in pagination_table.find_all('a'):
-                        href = link.get('href', '')
+                    for link in pagination_table.css('a'):
+                        href = link.attributes.get('href') or ''
                         if not href:
                             continue
                             
-                        text = link.text.strip()
-                        full_url = urljoin(BASE_URL, href)
+                        text = link.text().strip()
+                        full_url = _absolute_url(href)
                         
                         # Agregar todos los enlaces numéricos y el "Siguiente"
                         # También capturamos "Siguiente" para asegurar la navegación completa
                         if text.isdigit() or text == "Siguiente":
-                            print(f"Encontrado enlace de paginación: {text} -> {full_url}")
+                            log.debug("Encontrado enlace de paginación: %s -> %s", text, full_url)
                             new_links.add(full_url)
                 
                 # Método 2: Usar selectores CSS específicos para buscar enlaces de paginación
                 # Esto proporciona una capa adicional de robustez
-                pagination_links = soup.select(f"a[href*='productos_cat.asp?id={category_id}&pagina=']")
+                pagination_links = tree.css(page_link_selector)
                 for link in pagination_links:
-                    href = link.get("href")
+                    href = link.attributes.get("href")
                     if href:
-                        full_url = urljoin(BASE_URL, href)
+                        full_url = _absolute_url(href)
                         new_links.add(full_url)
                 
                 # Método 3: Buscar cualquier enlace que contenga la palabra "pagina="
-                pagination_links = soup.select("a[href*='pagina=']")
+                pagination_links = tree.css("a[href*='pagina=']")
                 for link in pagination_links:
-                    href = link.get("href")
+                    href = link.attributes.get("href")
                     # Verificar que el enlace pertenece a la misma categoría
-                    if href and f"id={category_id}" in href:
-                        full_url = urljoin(BASE_URL, href)
+                    if href and category_marker in href:
+                        full_url = _absolute_url(href)
                         new_links.add(full_url)
                 
                 # Método 4: Detectar específicamente los enlaces numéricos y "Siguiente" que pueden tener formato especial
                 # como los que aparecen en la imagen: <1>, <2>, etc.
-                for link in soup.find_all('a'):
-                    href = link.get('href', '')
-                    if not href or 'productos_cat.asp' not in href:
-                        continue
+                # El selector filtra los enlaces dentro del parser en lugar de revisar cada <a> en Python
+                for link in tree.css(CATEGORY_LINK_SELECTOR):
+                    href = link.attributes.get('href') or ''
                     
                     # Verificar si es un enlace de página numérico o "Siguiente"
-                    text = link.text.strip()
+                    text = link.text().strip()
                     if text == "Siguiente" or text.isdigit() or (text.startswith('<') and text.endswith('>') and text[1:-1].isdigit()):
                         # Asegurarnos que pertenece a la categoría correcta
-                        if f"id={category_id}" in href:
-                            full_url = urljoin(BASE_URL, href)
-                            print(f"Detectado enlace de navegación: '{text}' -> {full_url}")
+                        if category_marker in href:
+                            full_url = _absolute_url(href)
+                            log.debug("Detectado enlace de navegación: '%s' -> %s", text, full_url)
                             new_links.add(full_url)
                 
                 # Si hay un enlace "Siguiente", lo registramos específicamente
-                siguiente_link = soup.find('a', string="Siguiente")
-                if siguiente_link and siguiente_link.get('href'):
-                    siguiente_url = urljoin(BASE_URL, siguiente_link['href'])
+                siguiente_link = next((a for a in tree.css('a') if _has_text(a, "Siguiente")), None)
+                if siguiente_link and siguiente_link.attributes.get('href'):
+                    siguiente_url = _absolute_url(siguiente_link.attributes['href'])
                     if siguiente_url not in new_links:
-                        print(f"Enlace 'Siguiente' encontrado: {siguiente_url}")
+                        log.debug("Enlace 'Siguiente' encontrado: %s", siguiente_url)
                         new_links.add(siguiente_url)
                 
                 return new_links
@@ -210,42 +446,71 @@ class OfertasBScraper:
                 print(f"Error extrayendo enlaces de paginación de {url}: {str(e)}")
                 return set()
         
-        # Comenzar con la primera página
-        pages_to_check = set([base_url])
+        # Generar las URLs a partir del número de la última página enlazada. Si el paginador
+        # muestra solo una ventana de páginas, la última página revela las siguientes
+        try:
+            page_html[base_url] = await self._fetch_page(base_url)
+            max_page = _max_page_number(page_html[base_url], category_id)
+            while max_page:
+                last_url = f"{base_url}&pagina={max_page}"
+                page_html[last_url] = await self._fetch_page(last_url)
+                next_max = _max_page_number(page_html[last_url], category_id)
+                if next_max <= max_page:
+                    break
+                max_page = next_max
+
+            if max_page:
+                # La página 1 es la misma que base_url
+                pages_list = [base_url] + [f"{base_url}&pagina={n}" for n in range(2, max_page + 1)]
+                print(f"Encontradas {len(pages_list)} páginas para categoría {category_id}")
+
+                # Descargar en paralelo las páginas que aún no se tienen
+                missing = [url for url in pages_list if url not in page_html]
+                bodies = await asyncio.gather(*(self._fetch_page(url) for url in missing), return_exceptions=True)
+                for url, body in zip(missing, bodies):
+                    if isinstance(body, str):
+                        page_html[url] = body
+                return {url: page_html.get(url) for url in pages_list}
+        except Exception as e:
+            print(f"Error leyendo el paginador de {base_url}: {str(e)}")
+
+        # Respaldo: recorrer la paginación por niveles desde la primera página,
+        # descargando en paralelo todas las páginas de cada nivel
+        pages_to_check = [base_url]
         checked_pages = set()
         
         print(f"\nBuscando páginas para categoría {category_id}...")
         
         while pages_to_check:
-            current_url = pages_to_check.pop()
-            if current_url in checked_pages:
-                continue
-                
-            print(f"Analizando página: {current_url}")
-            new_pages = extract_page_links(current_url)
-            checked_pages.add(current_url)
-            pages.update(new_pages)
+            for current_url in pages_to_check:
+                log.debug("Analizando página: %s", current_url)
+            checked_pages.update(pages_to_check)
+            results = await asyncio.gather(*(extract_page_links(url) for url in pages_to_check))
             
-            # Agregar nuevas páginas no revisadas a la cola
-            pages_to_check.update(new_pages - checked_pages)
+            new_pages = set().union(*results)
+            pages.update(new_pages)
             
-            # Pequeña pausa para no sobrecargar el servidor
-            time.sleep(0.5)
+            # Las páginas nuevas no revisadas forman el siguiente nivel
+            pages_to_check = sorted(new_pages - checked_pages)
         
         pages_list = sorted(list(pages))
         print(f"Encontradas {len(pages_list)} páginas para categoría {category_id}")
-        return pages_list
+        return {url: page_html.get(url) for url in pages_list}
 
-    def fetch_category_pages(self, category_url: str, category_id: str):
-        """Fetch all pages for a given category and process products."""
+    async def fetch_category_pages(self, category_url: str, category_id: str, category: Optional[Dict] = None):
+        """Fetch all pages for a given category and process products.
+        Products are only saved when the full `category` is given, to resolve its internal Supabase id."""
         try:
             # Validar que category_id esté presente
             if not category_id:
                 raise ValueError("category_id is required")
 
+            added_products = []  # Lista para registrar productos añadidos
+
             # Usar el método get_category_pages que es más robusto para encontrar todas las páginas
             # ya que implementa una búsqueda recursiva de enlaces de paginación
-            pages = self.get_category_pages(category_id)
+            page_html = await self.get_category_pages(category_id)
+            pages = list(page_html)
             
             if not pages:
                 # Como respaldo, usar el método directo de búsqueda de enlaces
@@ -253,22 +518,23 @@ class OfertasBScraper:
                 pages = [base_url]  # Página inicial
                 
                 # Obtener el contenido de la página inicial
-                page_content = self._fetch_page(base_url)
-                soup = BeautifulSoup(page_content, "html.parser")
+                page_content = await self._fetch_page(base_url)
+                page_html[base_url] = page_content
+                tree = LexborHTMLParser(page_content)
                 
                 # Buscar enlaces de paginación usando un selector CSS con el ID de categoría
-                pagination_links = soup.select(f"a[href*='productos_cat.asp?id={category_id}&pagina=']")
+                pagination_links = tree.css(CATEGORY_PAGE_LINK_SELECTOR.format(category_id=category_id))
                 for link in pagination_links:
-                    href = link.get("href")
+                    href = link.attributes.get("href")
                     if href:
-                        full_url = urljoin(BASE_URL, href)
+                        full_url = _absolute_url(href)
                         if full_url not in pages:  # Evitar duplicados
                             pages.append(full_url)
                 
                 # Buscar específicamente el enlace "Siguiente" para asegurarnos de no perder páginas
-                siguiente_link = soup.find('a', string="Siguiente")
-                if siguiente_link and siguiente_link.get('href'):
-                    siguiente_url = urljoin(BASE_URL, siguiente_link['href'])
+                siguiente_link = next((a for a in tree.css('a') if _has_text(a, "Siguiente")), None)
+                if siguiente_link and siguiente_link.attributes.get('href'):
+                    siguiente_url = _absolute_url(siguiente_link.attributes['href'])
                     if siguiente_url not in pages:
                         print(f"Añadiendo enlace 'Siguiente' a las páginas a procesar: {siguiente_url}")
                         pages.append(siguiente_url)
@@ -289,86 +555,40 @@ class OfertasBScraper:
             
             print(f"Páginas encontradas para la categoría {category_id}: {len(pages)} (máximo número de página: {max_page_num})")
             
+            # products.category_id es el ID interno de Supabase, no el external_id de OfertasB
+            internal_cat_id = self._resolve_category(category) if category else None
+            if internal_cat_id is None:
+                return pages
+            
             # Mantener el progreso de categorías visible en la consola
             with tqdm.tqdm(total=len(pages), desc=f"Procesando categoría {category_id}", position=0, leave=True) as pbar:
                 for page_url in pages:
-                    print(f"Processing page: {page_url}")
-                    html = self._fetch_page(page_url)
-                    soup = BeautifulSoup(html, 'html.parser')
-
-                    # Buscar las tablas que contienen los productos
-                    product_tables = [
-                        table for table in soup.find_all('table')
-                        if table.get('width') == '200' and table.get('id') == 'customers'
-                        and table.find('a') and table.find('img')
-                        and len(table.find_all('tr')) >= 3
-                    ]
-
-                    if not product_tables:
-                        print(f"Warning: No product tables found on page {page_url}")
-                        continue
+                    log.debug("Processing page: %s", page_url)
+                    table_count, new_cards = await self._read_page(page_html, page_url)
 
-                    # Generar hashes para todos los productos en la página
-                    page_hashes = {}
-                    for product_table in product_tables:
-                        try:
-                            # Extraer datos básicos del producto
-                            img_row = product_table.find('tr').find('td').find('a')
-                            img_elem = img_row.find('img')
-                            list_image = urljoin(BASE_URL, img_elem['src'])
-
-                            name_cell = product_table.select_one('tr td[colspan="1"]')
-                            product_name = name_cell.get_text(strip=True)
-
-                            price_row = product_table.find_all('tr')[2]
-                            price_cell = price_row.find('td')
-                            price_raw = price_cell.text.strip()
-
-                            # Generar hash para el producto
-                            hash_data = f"{product_name}:{price_raw}:{list_image}"
-                            product_hash = hashlib.md5(hash_data.encode('utf-8')).hexdigest()
-
-                            # Asociar hash con la tabla del producto
-                            page_hashes[product_hash] = product_table
-                        except Exception as e:
-                            print(f"Error generating hash for product: {str(e)}")
-
-                    # Comparar hashes de la página con los existentes
-                    existing_hashes = set(self.existing_products.values())
-                    new_hashes = set(page_hashes.keys()) - existing_hashes
+                    if not table_count:
+                        tqdm.tqdm.write(f"Warning: No product tables found on page {page_url}")
+                        continue
 
-                    if not new_hashes:
-                        print(f"Saltando página {page_url} - todos los productos ya existen y no han cambiado")
+                    if not new_cards:
+                        log.debug("Saltando página %s - todos los productos ya existen y no han cambiado", page_url)
                         continue
 
                     # Inicializar barra de progreso para los productos de la página
-                    total_products = len(new_hashes)
-                    product_progress = tqdm.tqdm(total=total_products, desc=f"Página {page_url}", unit="producto")
+                    product_progress = tqdm.tqdm(
+                        total=len(new_cards), desc=f"Página {page_url}", unit="producto",
+                        mininterval=PROGRESS_MININTERVAL, miniters=max(1, len(new_cards) // 100)
+                    )
 
-                    # Procesar solo los productos necesarios
-                    for product_hash in new_hashes:
-                        product_table = page_hashes[product_hash]
-                        try:
-                            product_data = self.process_product_card(product_table, category['external_id'])
-                            if not product_data:
-                                product_progress.update(1)
-                                continue
+                    # Procesar solo los productos necesarios, descargando sus detalles en paralelo
+                    page_products = await asyncio.gather(*(
+                        self._complete_product(card, internal_cat_id) for card in new_cards
+                    ))
 
-                            # Upsert product
-                            result = self.supabase.upsert_product(product_data)
-                            if result:
-                                if result.get('inserted'):
-                                    print(f"Producto {product_data['external_product_id']} insertado como nuevo.")
-                                else:
-                                    print(f"Producto {product_data['external_product_id']} actualizado.")
-                                    
-                                added_products.append(product_data['external_product_id'])
-                            else:
-                                print(f"Error al insertar/actualizar el producto {product_data['external_product_id']}")
-                        except Exception as e:
-                            print(f"Error procesando el producto: {str(e)}")
-                        finally:
-                            product_progress.update(1)
+                    # Guardar todos los productos de la página en un solo upsert por lote
+                    page_batch = [product_data for product_data in page_products if product_data]
+                    product_progress.update(len(page_products))
+                    added_products.extend(self._flush_products(page_batch))
 
                     product_progress.close()
                     
@@ -377,203 +597,239 @@ class OfertasBScraper:
             print(f"Error fetching pages for category {category_id}: {str(e)}")
             return []
 
-    def get_product_details(self, product_id: str) -> Dict:
+    async def get_product_details(self, product_id: str) -> Dict:
         """Get detailed product information from the product page"""
         url = f"{BASE_URL}/productos_full.asp?id={product_id}"
-        html = self._fetch_page(url)
-        soup = BeautifulSoup(html, 'html.parser')
+        html = await self._fetch_page(url)
+        tree = LexborHTMLParser(html)
         
         # Buscar la tabla principal que contiene los detalles
         details = {}
         
-        # Buscar la imagen de alta calidad
-        # Primero buscamos en la tabla principal
-        main_content = soup.find('div', {'id': 'content'})
+        # Buscar la imagen de alta calidad solo dentro del contenido principal, para no
+        # tomar imágenes del encabezado, el pie o la barra lateral
+        main_content = tree.css_first('div#content')
         if main_content:
-            img = main_content.find('img', src=lambda x: x and ('upload' in x or 'images' in x))
-            if img and img.get('src'):
+            img = _find_product_image(main_content)
+            if img:
                 # Asegurarnos de que es una URL absoluta
-                img_src = img['src']
-                if img_src.startswith('/'):
-                    details['high_res_image'] = urljoin(BASE_URL, img_src)
-                else:
-                    details['high_res_image'] = img_src
+                details['high_res_image'] = _absolute_url(img.attributes['src'])
             
         # Buscar el nombre del producto
-        title = soup.find('td', class_='arial16')
+        title = tree.css_first('td.arial16')
         if title:
-            name_text = title.get_text(strip=True)
+            name_text = title.text(strip=True)
             if name_text:  # Asegurarnos de que no está vacío
                 details['full_name'] = name_text
             
         # Buscar precio y otros detalles
-        rows = soup.find_all('tr')
-        for row in rows:
+        for row in tree.css('tr'):
+            # El texto de la fila se obtiene una vez y filtra antes de recorrer sus nodos
+            row_text = row.text()
+
             # Buscar precio
-            if row.find(string=lambda x: x and isinstance(x, str) and 'Precio.' in x):
-                price_cell = row.find_all('td')[-1]
-                if price_cell and any(symbol in price_cell.text for symbol in ['₡', '¢']):
-                    price_raw = price_cell.get_text(strip=True)
-                    if price_raw:  # Asegurarnos de que no está vacío
-                        details['price_raw'] = price_raw
-                        _, price_numeric = parse_price(price_raw)
-                        details['price_numeric'] = price_numeric
+            if PRICE_LABEL in row_text:
+                price_cell = row.css('td')[-1]
+                price_text = _cell_text(price_cell) if price_cell else ''
+                if price_text and not PRICE_SYMBOLS.isdisjoint(price_text):
+                    details['price_raw'] = price_text
+                    _, price_numeric = parse_price(price_text)
+                    details['price_numeric'] = price_numeric
                     
             # Buscar estado
-            if row.find(string='Estado'):
-                estado = row.find_all('td')[-1]
-                if estado:
-                    details['estado'] = estado.get_text(strip=True)
+            if ESTADO_LABEL in row_text and _has_text(row, ESTADO_LABEL):
+                details['estado'] = _cell_text(row.css('td')[-1])
                     
             # Buscar peso
-            if row.find(string='Peso Gramos'):
-                peso = row.find_all('td')[-1]
-                if peso:
-                    details['peso'] = peso.get_text(strip=True)
+            if PESO_LABEL in row_text and _has_text(row, PESO_LABEL):
+                details['peso'] = _cell_text(row.css('td')[-1])
                     
             # Buscar categoría completa
-            if row.find(string='Categoria'):
-                categoria = row.find_all('td')[-1]
-                if categoria:
-                    details['categoria_full'] = categoria.get_text(strip=True)
+            if CATEGORY_LABEL in row_text and _has_text(row, CATEGORY_LABEL):
+                details['categoria_full'] = _cell_text(row.css('td')[-1])
         
         return details
 
-    def process_product_card(self, product_table: BeautifulSoup, category_id: int) -> Dict:
+    def _product_details_once(self, product_id: int) -> asyncio.Task:
+        """Devuelve la tarea que descarga los detalles del producto, creándola solo la primera vez"""
+        task = self._detail_tasks.get(product_id)
+        if task is None:
+            task = asyncio.ensure_future(self.get_product_details(product_id))
+            self._detail_tasks[product_id] = task
+        return task
+
+    async def _read_page(self, page_html: Dict[str, Optional[str]], page_url: str) -> Tuple[int, List[Dict]]:
+        """Obtiene el HTML de una página del listado y lo analiza con _changed_cards"""
+        # Reusar el HTML de la búsqueda de páginas y liberarlo una vez procesado
+        html = page_html.pop(page_url, None) or await self._fetch_page(page_url)
+
+        # Si el HTML es idéntico al de una pasada en la que todo ya estaba guardado, no hay nada que parsear
+        body_hash = xxhash.xxh3_128_digest(html.encode('utf-8'))
+        cached = self._page_cache.execute(
+            "SELECT body_hash, product_count FROM pages WHERE url = ?", (page_url,)
+        ).fetchone()
+        if cached and cached[0] == body_hash:
+            log.debug("Página sin cambios desde la última ejecución: %s", page_url)
+            return cached[1], []
+
+        # El parseo y la consulta de hashes en Supabase son bloqueantes: correrlos fuera del event loop
+        table_count, new_cards = await asyncio.to_thread(self._changed_cards, html)
+
+        # Recordar la página solo cuando todos sus productos ya coinciden con Supabase
+        if table_count and not new_cards:
+            self._page_cache.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?)", (page_url, body_hash, table_count)
+            )
+            # Confirmar en seguida: si la ejecución se interrumpe, la página sigue marcada al día
+            self._page_cache.commit()
+        return table_count, new_cards
+
+    def _changed_cards(self, html: str) -> Tuple[int, List[Dict]]:
+        """Parsea un listado una sola vez y devuelve su número de tarjetas y los datos de las que cambiaron.
+        El árbol se libera al volver; solo quedan los campos ya extraídos."""
+        tree = LexborHTMLParser(html)
+
+        # Buscar las tablas que contienen los productos
+        product_tables = _find_product_tables(tree)
+
+        # Extraer los datos y el hash de todos los productos en la página, por external_product_id
+        cards = {}
+        for product_table in product_tables:
+            try:
+                card = _parse_card(product_table)
+                cards[str(card['external_product_id'])] = card
+            except Exception as e:
+                log.warning("Error generating hash for product: %s", e)
+
+        # Comparar el hash de cada producto con el guardado para ese mismo producto
+        stored_hashes = self._load_existing_products(
+            list(cards), [card['source_html_hash'] for card in cards.values()]
+        )
+        changed = [
+            card for product_id, card in cards.items()
+            if stored_hashes.get(product_id) != card['source_html_hash']
+        ]
+        return len(product_tables), changed
+
+    async def process_product_card(self, product_table: LexborNode, category_id: int) -> Dict:
         """Extract product information from a product table without visiting the product page."""
         try:
-            # Obtener enlace del producto y extraer el ID
-            img_row = product_table.find('tr').find('td').find('a')
-            if img_row and img_row.get('href'):
-                product_url = urljoin(BASE_URL, img_row['href'])
-                try:
-                    external_product_id = int(product_url.split('id=')[-1])  # Convertir a entero
-                except ValueError:
-                    raise ValueError(f"Invalid external_product_id extracted from URL: {product_url}")
-            else:
-                raise ValueError("Could not find product link")
-
-            # Obtener imagen en miniatura como fallback
-            img_elem = img_row.find('img')
-            if not img_elem or not img_elem.get('src'):
-                logging.warning(f"No thumbnail image for product {external_product_id}")
-                list_image = None
-            else:
-                list_image = urljoin(BASE_URL, img_elem['src'])
-                
-            # Obtener imagen de alta calidad de la página de detalle del producto
-            try:
-                print(f"Obteniendo imagen de alta calidad para producto {external_product_id}")
-                detail_url = f"{BASE_URL}/productos_full.asp?id={external_product_id}"
-                detail_html = self._fetch_page(detail_url)
-                detail_soup = BeautifulSoup(detail_html, 'html.parser')
-                
-                # Buscar la imagen de alta resolución en la página de detalle
-                main_content = detail_soup.find('div', {'id': 'content'}) or detail_soup
-                img = main_content.find('img', src=lambda x: x and ('upload' in x or 'images' in x))
-                
-                if img and img.get('src'):
-                    high_res_image = urljoin(BASE_URL, img['src'])
-                    print(f"Imagen de alta calidad encontrada: {high_res_image}")
-                    list_image = high_res_image  # Reemplazar la miniatura con la imagen de alta calidad
-                else:
-                    print(f"No se encontró imagen de alta calidad, usando miniatura: {list_image}")
-            except Exception as img_error:
-                print(f"Error al obtener imagen de alta calidad: {str(img_error)}")
-                # Mantener la imagen en miniatura como respaldo
-
-            # Obtener nombre y precio desde la tabla de la categoría
-            name_cell = product_table.select_one('tr td[colspan="1"]')
-            if not name_cell or not name_cell.get_text(strip=True):
-                raise ValueError("Could not find product name")
-            product_name = name_cell.get_text(strip=True)
-
-            price_row = product_table.find_all('tr')[2]
-            if not price_row:
-                raise ValueError("Could not find price row")
-            price_cell = price_row.find('td')
-            if not price_cell or not any(symbol in price_cell.text for symbol in ['₡', '¢']):
-                raise ValueError("Could not find price element")
-            price_raw = price_cell.text.strip()
-            _, price_numeric = parse_price(price_raw)
-
-            # Validar que price_numeric es válido
-            if not isinstance(price_numeric, (int, float)):
-                raise ValueError(f"Invalid price_numeric for product {external_product_id}: {price_numeric}")
-
-            # Generar el hash del producto actual usando solo datos de la categoría
-            hash_components = {
-                'name': str(product_name),
-                'price': str(price_raw),
-                'image': str(list_image)
-            }
-            hash_data = f"{hash_components['name']}:{hash_components['price']}:{hash_components['image']}"
-            current_hash = hashlib.md5(hash_data.encode('utf-8')).hexdigest()
+            card = _parse_card(product_table)
+        except Exception as e:
+            log.error("Error processing product: %s", e)
+            return None
+        return await self._complete_product(card, category_id)
+
+    async def _complete_product(self, card: Dict, category_id: int) -> Dict:
+        """Arma la fila del producto a partir de los datos de su tarjeta, con los detalles opcionales."""
+        try:
+            external_product_id = card['external_product_id']
+            current_hash = card['source_html_hash']
 
             # Si el producto existe y su hash no ha cambiado, lo saltamos
-            if external_product_id in self.existing_products:
-                existing_hash = self.existing_products[external_product_id]
-                if existing_hash == current_hash:
-                    logging.info(f"Skipping product {external_product_id} - no changes detected")
-                    return None
+            # (Supabase guarda external_product_id como texto)
+            if self.existing_products.get(str(external_product_id)) == current_hash:
+                log.debug("Skipping product %s - no changes detected", external_product_id)
+                return None
+
+            # Solo los productos nuevos o modificados pasan a la página de detalle (opcional)
+            details = {}
+            list_image = card['image_url']
+            image_url = list_image
+            if self.fetch_details:
+                cached = self._image_cache.execute(
+                    "SELECT image_url FROM images WHERE external_product_id = ?", (str(external_product_id),)
+                ).fetchone()
+                if cached:
+                    image_url = cached[0]
+                else:
+                    try:
+                        log.debug("Obteniendo detalles para producto %s", external_product_id)
+                        details = await self._product_details_once(external_product_id)
+                        if details.get('high_res_image'):
+                            image_url = details['high_res_image']  # Reemplazar la miniatura con la imagen de alta calidad
+                            self._image_cache.execute(
+                                "INSERT OR REPLACE INTO images VALUES (?, ?)", (str(external_product_id), image_url)
+                            )
+                        else:
+                            log.debug("No se encontró imagen de alta calidad, usando miniatura: %s", list_image)
+                    except Exception as detail_error:
+                        log.warning("Error al obtener detalles del producto %s: %s", external_product_id, detail_error)
+                        # Permitir un nuevo intento si el producto vuelve a aparecer
+                        self._detail_tasks.pop(external_product_id, None)
 
-            # Imprimir y guardar en el log los datos del producto para depuración
-            log_message = f"Procesando producto {external_product_id}: {product_name}, Precio: {price_raw}, Imagen: {list_image}"
-            print(log_message)
-            logging.info(log_message)
+            # Guardar en el log los datos del producto para depuración
+            log.debug("Procesando producto %s: %s, Precio: %s, Imagen: %s",
+                      external_product_id, card['name'], card['price_raw'], image_url)
 
             # Retornar datos básicos del producto
-            return {
-                "external_product_id": external_product_id,
-                "product_url": product_url,
-                "image_url": list_image,
-                "name": product_name,
-                "price_raw": price_raw,
-                "price_numeric": float(price_numeric),
-                "source_html_hash": current_hash,
+            product_data = {
+                **card,
+                "image_url": image_url,
+                "source_html_hash": current_hash.hex(),
                 "category_id": category_id
             }
+            for field in ('estado', 'peso', 'categoria_full'):
+                if details.get(field):
+                    product_data[field] = details[field]
+            return product_data
 
         except Exception as e:
-            error_message = f"Error processing product: {str(e)}"
-            print(error_message)
-            logging.error(error_message)
+            log.error("Error processing product: %s", e)
             return None
     
-    def scrape_category(self, category_id: Optional[str] = None):
+    def _flush_products(self, pending_products: List[Dict]) -> List[str]:
+        """Guarda los productos pendientes en un único upsert y vacía la lista"""
+        if not pending_products:
+            return []
+        saved = self.supabase.upsert_products_batch(pending_products)
+        # Escribir por encima de las barras de progreso sin forzar que se redibujen de más
+        tqdm.tqdm.write(f"Guardados {len(saved)} de {len(pending_products)} productos en Supabase")
+        pending_products.clear()
+        # Actualizar el cache local con los hashes recién guardados
+        for row in saved:
+            self.existing_products[row['external_product_id']] = _stored_hash(row['source_html_hash'])
+        return [row['external_product_id'] for row in saved]
+
+    async def scrape_category(self, category_id: Optional[str] = None):
         """Scrape a single category or all categories"""
-        categories = ([c for c in self.get_categories() if c['external_id'] == category_id] 
-                     if category_id else self.get_categories())
+        categories = ([c for c in await self.get_categories() if c['external_id'] == category_id] 
+                     if category_id else await self.get_categories())
 
-        # Verificar y utilizar categorías existentes en Supabase
-        for category in categories:
-            try:
-                existing_category = self.supabase.client.table("categories").select("id").eq("external_id", category["external_id"]).execute()
-                if existing_category.data:
-                    print(f"Categoría existente encontrada: {category['name']} (ID: {category['external_id']})")
-                    # Asegurarse de que category tenga el campo 'id' de Supabase
-                    category['supabase_id'] = existing_category.data[0]['id']
-                    print(f"ID en Supabase para categoría {category['external_id']}: {category['supabase_id']}")
-                else:
-                    print(f"Insertando nueva categoría: {category['name']} (ID: {category['external_id']})")
-                    result = self.supabase.client.table("categories").insert({
+        # Verificar y utilizar categorías existentes en Supabase: una consulta para todas
+        # y un solo insert para las que faltan
+        try:
+            existing_categories = self.supabase.client.table("categories").select("id,external_id").in_(
+                "external_id", [category["external_id"] for category in categories]
+            ).execute()
+            supabase_ids = {row['external_id']: row['id'] for row in existing_categories.data}
+
+            missing = [category for category in categories if category['external_id'] not in supabase_ids]
+            if missing:
+                print(f"Insertando {len(missing)} categorías nuevas...")
+                crawled_at = utc_now_iso()
+                result = self.supabase.client.table("categories").insert([
+                    {
                         "external_id": category["external_id"],
                         "name": category["name"],
                         "source_url": category["source_url"],
-                        "last_crawled_at": datetime.utcnow().isoformat(),
+                        "last_crawled_at": crawled_at,
                         "seller_id": 1
-                    }).execute()
-                    
-                    if result.data:
-                        category['supabase_id'] = result.data[0]['id']
-                        print(f"Nueva categoría insertada con ID en Supabase: {category['supabase_id']}")
-                    else:
-                        print(f"⚠️ Advertencia: No se pudo obtener ID después de insertar categoría {category['external_id']}")
-            except Exception as e:
-                print(f"Error al procesar categoría {category['external_id']}: {str(e)}")
+                    }
+                    for category in missing
+                ]).execute()
+                supabase_ids.update({row['external_id']: row['id'] for row in result.data or []})
+            self._category_ids.update(supabase_ids)
 
-        # Cargar productos existentes
-        self._load_existing_products(category_id)
+            for category in categories:
+                # Asegurarse de que category tenga el campo 'id' de Supabase
+                if category['external_id'] in supabase_ids:
+                    category['supabase_id'] = supabase_ids[category['external_id']]
+                    print(f"ID en Supabase para categoría {category['external_id']}: {category['supabase_id']}")
+                else:
+                    print(f"⚠️ Advertencia: No se pudo obtener ID después de insertar categoría {category['external_id']}")
+        except Exception as e:
+            print(f"Error al procesar las categorías: {str(e)}")
 
         # Inicializar barra de progreso para las categorías
         total_categories = len(categories)
@@ -582,179 +838,205 @@ class OfertasBScraper:
         for category in categories:
             print(f"\nProcesando categoría: {category['name']} ({category['external_id']})")
 
-            # Primero contar productos totales
+            # products.category_id es el ID interno de Supabase, no el external_id de OfertasB
+            internal_cat_id = self._resolve_category(category)
+            if internal_cat_id is None:
+                category_progress.update(1)
+                continue
+
+            # Contar los productos de la categoría durante el mismo recorrido de páginas
             total_products = 0
             added_products = []  # Lista para registrar productos añadidos
-            pages = self.get_category_pages(category['external_id'])
+            pending_products = []  # Productos a la espera del próximo upsert por lote
+            # El cache solo se necesita dentro de la categoría; vaciarlo acota la memoria
+            self.existing_products.clear()
+            pages = await self.get_category_pages(category['external_id'])
             print(f"Encontradas {len(pages)} páginas")
 
             # Inicializar barra de progreso para las páginas de la categoría
             total_pages = len(pages)
             page_progress = tqdm.tqdm(total=total_pages, desc=f"Categoría {category['name']}", unit="página")
 
-            for page_url in pages:
-                print(f"Processing page: {page_url}")
-                html = self._fetch_page(page_url)
-                soup = BeautifulSoup(html, 'html.parser')
-
-                # Buscar las tablas que contienen los productos
-                product_tables = [
-                    table for table in soup.find_all('table')
-                    if table.get('width') == '200' and table.get('id') == 'customers'
-                    and table.find('a') and table.find('img')
-                    and len(table.find_all('tr')) >= 3
-                ]
-
-                if not product_tables:
-                    print(f"Warning: No product tables found on page {page_url}")
-                    continue
-
-                # Generar hashes para todos los productos en la página
-                page_hashes = {}
-                for product_table in product_tables:
+            next_page = None
+            try:
+                page_urls = list(pages)
+                next_page = asyncio.ensure_future(self._read_page(pages, page_urls[0])) if page_urls else None
+                for index, page_url in enumerate(page_urls):
+                    log.debug("Processing page: %s", page_url)
                     try:
-                        # Extraer datos básicos del producto
-                        img_row = product_table.find('tr').find('td').find('a')
-                        img_elem = img_row.find('img')
-                        list_image = urljoin(BASE_URL, img_elem['src'])
-
-                        name_cell = product_table.select_one('tr td[colspan="1"]')
-                        product_name = name_cell.get_text(strip=True)
-
-                        price_row = product_table.find_all('tr')[2]
-                        price_cell = price_row.find('td')
-                        price_raw = price_cell.text.strip()
-
-                        # Generar hash para el producto
-                        hash_data = f"{product_name}:{price_raw}:{list_image}"
-                        product_hash = hashlib.md5(hash_data.encode('utf-8')).hexdigest()
-
-                        # Asociar hash con la tabla del producto
-                        page_hashes[product_hash] = product_table
+                        table_count, new_cards = await next_page
                     except Exception as e:
-                        print(f"Error generating hash for product: {str(e)}")
+                        # Una página que falla tras los reintentos no detiene el resto de la categoría
+                        tqdm.tqdm.write(f"Error leyendo la página {page_url}: {str(e)}")
+                        table_count = new_cards = None
+                    page_progress.update(1)
+
+                    # Descargar y analizar la página siguiente mientras se completan los productos de esta
+                    next_page = (
+                        asyncio.ensure_future(self._read_page(pages, page_urls[index + 1]))
+                        if index + 1 < len(page_urls) else None
+                    )
+
+                    if table_count is None:
+                        continue
 
-                # Comparar hashes de la página con los existentes
-                existing_hashes = set(self.existing_products.values())
-                new_hashes = set(page_hashes.keys()) - existing_hashes
+                    if not table_count:
+                        tqdm.tqdm.write(f"Warning: No product tables found on page {page_url}")
+                        continue
 
-                if not new_hashes:
-                    print(f"Saltando página {page_url} - todos los productos ya existen y no han cambiado")
-                    continue
+                    total_products += table_count
 
-                # Inicializar barra de progreso para los productos de la página
-                total_products = len(new_hashes)
-                product_progress = tqdm.tqdm(total=total_products, desc=f"Página {page_url}", unit="producto")
+                    if not new_cards:
+                        log.debug("Saltando página %s - todos los productos ya existen y no han cambiado", page_url)
+                        continue
 
-                # Procesar solo los productos necesarios
-                for product_hash in new_hashes:
-                    product_table = page_hashes[product_hash]
-                    try:
-                        product_data = self.process_product_card(product_table, category['external_id'])
-                        if not product_data:
+                    # Inicializar barra de progreso para los productos de la página
+                    product_progress = tqdm.tqdm(
+                        total=len(new_cards), desc=f"Página {page_url}", unit="producto",
+                        mininterval=PROGRESS_MININTERVAL, miniters=max(1, len(new_cards) // 100)
+                    )
+
+                    # Procesar solo los productos necesarios, descargando sus detalles en paralelo
+                    page_products = await asyncio.gather(*(
+                        self._complete_product(card, internal_cat_id) for card in new_cards
+                    ))
+                    for product_data in page_products:
+                        try:
+                            if not product_data:
+                                continue
+
+                            # Acumular el producto y enviarlo en el próximo upsert por lote
+                            pending_products.append(product_data)
+                            if len(pending_products) >= UPSERT_BATCH_SIZE:
+                                added_products.extend(self._flush_products(pending_products))
+                        except Exception as e:
+                            print(f"Error procesando el producto: {str(e)}")
+                        finally:
                             product_progress.update(1)
-                            continue
 
-                        # Upsert product
-                        result = self.supabase.upsert_product(product_data)
-                        if result:
-                            if result.get('inserted'):
-                                print(f"Producto {product_data['external_product_id']} insertado como nuevo.")
-                            else:
-                                print(f"Producto {product_data['external_product_id']} actualizado.")
-                                
-                            added_products.append(product_data['external_product_id'])
-                        else:
-                            print(f"Error al insertar/actualizar el producto {product_data['external_product_id']}")
-                    except Exception as e:
-                        print(f"Error procesando el producto: {str(e)}")
-                    finally:
-                        product_progress.update(1)
+                    product_progress.close()
+            finally:
+                # Si se sale antes de tiempo, no dejar la lectura anticipada pendiente
+                if next_page is not None and not next_page.done():
+                    next_page.cancel()
+                page_progress.close()
 
-                product_progress.close()
-                
-            page_progress.close()
+                # Enviar los productos restantes de la categoría, también si una página falló
+                added_products.extend(self._flush_products(pending_products))
+
+            # Guardar el conteo final de productos en la categoría
+            try:
+                self.supabase.finalize_category(category['external_id'], total_products)
+            except Exception as e:
+                print(f"Error al actualizar el conteo de la categoría {category['external_id']}: {str(e)}")
 
-            # Actualizar el cache local con los nuevos productos añadidos
-            for product_id in added_products:
-                product_hash = hashlib.md5(f"{product_id}".encode('utf-8')).hexdigest()
-                self.existing_products[product_id] = product_hash
-            
             category_progress.update(1)
 
         category_progress.close()
 
-    def scrape_all(self):
+    async def scrape_all(self):
         """Scrape all categories"""
-        self.scrape_category()
+        await self.scrape_category()
 
-    def fetch_category(self, category_id: str) -> Dict:
+    async def fetch_category(self, category_id: str) -> Dict:
         """Fetch a specific category by its external_id"""
         try:
-            categories = self.fetch_categories()
-            for category in categories:
-                if category["external_id"] == category_id:
-                    print(f"Categoría encontrada: {category['name']} ({category['external_id']})")
-                    return category
-            raise ValueError(f"Categoría con ID {category_id} no encontrada")
+            await self.fetch_categories()
+            category = self._category_options_by_id.get(category_id)
+            if category is None:
+                raise ValueError(f"Categoría con ID {category_id} no encontrada")
+            print(f"Categoría encontrada: {category['name']} ({category['external_id']})")
+            return category
         except Exception as e:
             print(f"Error fetching category {category_id}: {str(e)}")
             return {}
 
-    def process_page(self, page_url: str, category: Dict):
+    def _resolve_category(self, category: Dict) -> Optional[int]:
+        """ID interno en Supabase de la categoría, insertándola si no existe. Se consulta una vez por ejecución."""
+        if category['external_id'] in self._category_ids:
+            return self._category_ids[category['external_id']]
+        category_row = {
+            "external_id": category['external_id'],
+            "name": category['name'],
+            # Las categorías de fetch_categories traen la URL en 'url'
+            "source_url": category.get('source_url') or category.get('url', ''),
+            "last_crawled_at": utc_now_iso(),
+            "seller_id": 1
+        }
+        try:
+            # Un solo upsert crea la categoría si falta y devuelve su ID interno
+            cat_result = self.supabase.client.table("categories").upsert(
+                category_row, on_conflict="external_id"
+            ).execute()
+        except Exception as e:
+            log.warning("Upsert de la categoría %s rechazado (%s); consultando por separado", category['external_id'], e)
+            cat_result = None
+
+        try:
+            if cat_result is None:
+                # Respaldo si external_id no tiene restricción única: consultar e insertar si falta
+                cat_result = self.supabase.client.table("categories").select("id, external_id").eq("external_id", category['external_id']).execute()
+                if not cat_result.data:
+                    print(f"⚠️ La categoría {category['external_id']} no existe en Supabase. Insertándola...")
+                    cat_result = self.supabase.client.table("categories").insert(category_row).execute()
+
+            if not cat_result.data:
+                print(f"❌ Error al guardar categoría {category['external_id']}")
+                return None
+            internal_cat_id = cat_result.data[0]['id']  # ID interno en Supabase
+            print(f"✅ Categoría {category['external_id']} con ID interno: {internal_cat_id}")
+        except Exception as e:
+            print(f"Error al procesar categoría {category['external_id']}: {str(e)}")
+            return None
+
+        self._category_ids[category['external_id']] = internal_cat_id
+        return internal_cat_id
+
+    async def process_page(self, page_url: str, category: Dict):
         """Process a specific page of a category"""
         try:
-            print(f"Procesando página: {page_url}")
-            page_content = self._fetch_page(page_url)
-            soup = BeautifulSoup(page_content, "html.parser")
+            log.debug("Procesando página: %s", page_url)
+            page_content = await self._fetch_page(page_url)
+            tree = LexborHTMLParser(page_content)
 
-            # Ajustar el selector para buscar productos
-            product_tables = soup.find_all("table")  # Buscar todas las tablas como punto de partida
+            # Buscar las tablas que contienen los productos
+            product_tables = _find_product_tables(tree)
             if not product_tables:
                 print(f"No se encontraron productos en la página: {page_url}")
                 return
 
+            # Resolver el ID interno de la categoría una sola vez para toda la página
+            internal_cat_id = self._resolve_category(category)
+            if internal_cat_id is None:
+                return
+
             # Inicializar barra de progreso
             total_products = len(product_tables)
-            product_progress = tqdm.tqdm(total=total_products, desc=f"Procesando productos en {page_url}", unit="producto")
+            product_progress = tqdm.tqdm(
+                total=total_products, desc=f"Procesando productos en {page_url}", unit="producto",
+                mininterval=PROGRESS_MININTERVAL, miniters=max(1, total_products // 100)
+            )
 
+            page_batch = []  # Productos de la página, guardados juntos en un solo upsert
             for product_table in product_tables:
-                # Antes de procesar el producto, asegurémonos de que la categoría existe en Supabase
                 try:
-                    # Usamos el external_id para encontrar la categoría en Supabase
-                    cat_response = self.supabase.client.table("categories").select("id, external_id").eq("external_id", category['external_id']).execute()
-                    
-                    if not cat_response.data:
-                        print(f"⚠️ La categoría {category['external_id']} no existe en Supabase. Insertándola...")
-                        cat_result = self.supabase.client.table("categories").insert({
-                            "external_id": category['external_id'],
-                            "name": category['name'],
-                            "source_url": category.get('source_url', ''),
-                            "last_crawled_at": datetime.utcnow().isoformat(),
-                            "seller_id": 1
-                        }).execute()
-                        
-                        if cat_result.data:
-                            internal_cat_id = cat_result.data[0]['id']  # ID interno en Supabase
-                            print(f"✅ Categoría {category['external_id']} insertada con ID interno: {internal_cat_id}")
-                        else:
-                            print(f"❌ Error al insertar categoría {category['external_id']}")
-                            continue
-                    else:
-                        internal_cat_id = cat_response.data[0]['id']  # ID interno en Supabase
-                        print(f"✅ Categoría {category['external_id']} ya existe con ID interno: {internal_cat_id}")
-                    
                     # Procesamos el producto pasando el ID interno de la categoría
-                    product_data = self.process_product_card(product_table, internal_cat_id)
+                    product_data = await self.process_product_card(product_table, internal_cat_id)
                     if product_data:
-                        result = self.supabase.upsert_product(product_data)
-                        if result:
-                            print(f"Producto {product_data['external_product_id']} procesado exitosamente.")
+                        page_batch.append(product_data)
                 except Exception as e:
-                    print(f"Error al procesar categoría {category['external_id']}: {str(e)}")
+                    log.warning("Error al procesar el producto de la categoría %s: %s", category['external_id'], e)
                 product_progress.update(1)
 
             product_progress.close()
+
+            # Guardar los productos de la página en lotes de hasta UPSERT_BATCH_SIZE
+            saved = 0
+            for start in range(0, len(page_batch), UPSERT_BATCH_SIZE):
+                saved += len(self._flush_products(page_batch[start:start + UPSERT_BATCH_SIZE]))
+
+            # Un solo resumen por página en lugar de una línea por producto
+            log.info("page=%s products=%d new=%d saved=%d", page_url, total_products, len(page_batch), saved)
         except Exception as e:
             print(f"Error procesando la página {page_url}: {str(e)}")
 
@@ -765,22 +1047,21 @@ def find_product_category(product_id: int):
         print(f"Buscando producto en: {url}")
         response = httpx.get(url)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
+        tree = LexborHTMLParser(response.text)
 
         # Depuración: Imprimir parte del contenido HTML
         print("Contenido HTML de la página del producto (primeros 500 caracteres):")
         print(response.text[:500])
 
         # Buscar la categoría en la página del producto
-        category_label = soup.find(text=lambda text: text and "sin categoria" in text.lower())
-        if category_label:
+        if "sin categoria" in tree.text().lower():
             print(f"Producto {product_id} pertenece a la categoría: 'sin categoría'")
             return {"category_name": "sin categoría", "category_url": None}
 
-        category_link = soup.find("a", href=lambda href: href and "productos_cat.asp?id=" in href)
+        category_link = tree.css_first('a[href*="productos_cat.asp?id="]')
         if category_link:
-            category_url = urljoin(BASE_URL, category_link["href"])
-            category_name = category_link.get_text(strip=True)
+            category_url = _absolute_url(category_link.attributes["href"])
+            category_name = category_link.text(strip=True)
             print(f"Producto {product_id} pertenece a la categoría: {category_name} ({category_url})")
             return {"category_name": category_name, "category_url": category_url}
         else:
@@ -790,7 +1071,8 @@ def find_product_category(product_id: int):
         print(f"Error buscando la categoría del producto {product_id}: {str(e)}")
         return None
 
-def main():
+async def main(argv: Optional[List[str]] = None):
+    """Punto de entrada del scraper; `argv` permite invocarlo desde otro script sin lanzar un proceso nuevo"""
     print("Iniciando el script...")
 
     parser = argparse.ArgumentParser(description='Scrape OfertasB products')
@@ -798,26 +1080,27 @@ def main():
     group.add_argument('--all', action='store_true', help='Scrape all categories')
     group.add_argument('--category', type=str, help='Scrape specific category ID')
     group.add_argument('--categories', type=str, help='Scrape specific category IDs separated by commas (e.g., 193,212,124)')
+    parser.add_argument('--fetch-details', action='store_true', help='Visit each product page for the high-res image and extra fields')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    scraper = OfertasBScraper()
+    scraper = OfertasBScraper(fetch_details=args.fetch_details)
     try:
         print("Cargando categorías...")
         if args.all:
-            categories = scraper.fetch_categories()
+            categories = await scraper.fetch_categories()
         elif args.categories:
             category_ids = args.categories.split(',')
             categories = []
             for cat_id in category_ids:
                 try:
-                    cat = scraper.fetch_category(cat_id.strip())
+                    cat = await scraper.fetch_category(cat_id.strip())
                     if cat:
                         categories.append(cat)
                 except Exception as e:
                     print(f"Error cargando la categoría {cat_id}: {str(e)}")
         else:
-            categories = [scraper.fetch_category(args.category)]
+            categories = [await scraper.fetch_category(args.category)]
         print(f"Categorías cargadas: {len(categories)}")
 
         # Inicializar barra de progreso para las categorías
@@ -826,29 +1109,18 @@ def main():
 
         for category in categories:
             print(f"Procesando categoría: {category['name']} ({category['external_id']})")
-            pages = scraper.fetch_category_pages(category['url'], category['external_id'])
-            print(f"Páginas encontradas para la categoría {category['name']}: {len(pages)}")
-
-            # Inicializar barra de progreso para las páginas
-            total_pages = len(pages)
-            page_progress = tqdm.tqdm(total=total_pages, desc=f"Categoría {category['name']}", unit="página")
-
-            for page_url in pages:
-                print(f"Analizando página: {page_url}")
-                # Asegurar que la categoría no sea None
-                category = next((c for c in categories if c['external_id'] == category['external_id']), None)
-                if not category:
-                    raise ValueError("La categoría no está definida al procesar la página")
-                scraper.process_page(page_url, category)
-                page_progress.update(1)
-
-            page_progress.close()
+            # fetch_category_pages ya guarda los productos nuevos o modificados de cada página;
+            # las páginas que el cache de listados marca como al día no se vuelven a procesar
+            pages = await scraper.fetch_category_pages(category['url'], category['external_id'], category)
+            print(f"Páginas procesadas para la categoría {category['name']}: {len(pages)}")
             category_progress.update(1)
 
         category_progress.close()
         print("Script completado.")
     except Exception as e:
         print(f"Error en la ejecución del script: {str(e)}")
+    finally:
+        await scraper.close()
 
 # Ejecución directa
 if __name__ == "__main__":
@@ -856,14 +1128,15 @@ if __name__ == "__main__":
     parser.add_argument("--all", action="store_true", help="Ejecutar el scraper para todas las categorías.")
     parser.add_argument("--categories", type=str, help="Ejecutar el scraper para categorías específicas, separadas por comas (ej: 193,212,124).")
     parser.add_argument("--find-product", type=int, help="Buscar un producto por su external_product_id.")
+    parser.add_argument("--fetch-details", action="store_true", help="Visitar la página de cada producto para la imagen grande y los detalles.")
     args = parser.parse_args()
 
     if args.find_product:
         find_product_category(args.find_product)
     elif args.categories:
         print(f"Ejecutando el scraper para categorías específicas: {args.categories}")
-        main()
+        asyncio.run(main())
     elif args.all:
         # Lógica existente para ejecutar el scraper completo
         print("Ejecutando el scraper para todas las categorías...")
-        main()
+        asyncio.run(main())
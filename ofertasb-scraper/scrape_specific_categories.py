@@ -1,10 +1,11 @@
 """
 Script para ejecutar el scraper solamente para las categorías seleccionadas
 """
-import subprocess
-import os
+import asyncio
 import sys
 
+from scrape_ofertasb import main as scraper_main
+
 def main():
     """
     Ejecuta el scraper para las categorías específicas: 193, 212 y 124
@@ -14,15 +15,11 @@ def main():
     print(f"Ejecutando el scraper para las categorías: {categories}")
     print("-----------------------------------------------")
     
-    # Construir el comando
-    script_path = os.path.join(os.path.dirname(__file__), "scrape_ofertasb.py")
-    command = [sys.executable, script_path, "--categories", categories]
-    
-    # Ejecutar el comando
+    # Ejecutar el scraper en este mismo proceso, sin arrancar otro intérprete
     try:
-        subprocess.run(command, check=True)
+        asyncio.run(scraper_main(["--categories", categories]))
         print("\nScraper completado exitosamente.")
-    except subprocess.CalledProcessError as e:
+    except Exception as e:
         print(f"\nError al ejecutar el scraper: {str(e)}")
         return 1
     
@@ -12,22 +12,108 @@ import re
 import sys
 import random
 import argparse
+import asyncio
+import logging
 import httpx
+import orjson
 import tqdm
 from typing import Dict, List, Any, Optional
 from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser, LexborNode
 from datetime import datetime
 from supabase import create_client
 from dotenv import load_dotenv
+from utils.dates import utc_now_iso
+from utils.rate_limit import RateLimiter
 
 # Cargar variables de entorno
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Constantes
 BASE_URL = "https://www.ofertasb.com"
-SLEEP_MIN = 1.0  # Tiempo mínimo de espera entre solicitudes (segundos)
-SLEEP_MAX = 2.0  # Tiempo máximo de espera entre solicitudes (segundos)
+MAX_REQUESTS_PER_SECOND = 2  # Ritmo máximo de solicitudes contra OfertasB, sumando todas las tareas
+FETCH_ATTEMPTS = 4  # Intentos por página ante errores transitorios
+MAX_BACKOFF = 30.0  # Espera máxima entre reintentos (segundos)
+INSERT_BATCH_SIZE = 500  # Productos por insert a Supabase
+MAX_CONCURRENT_REQUESTS = 5  # Páginas descargadas en paralelo
+LISTING_WINDOW = 10  # Páginas del listado pedidas juntas antes de revisar si el listado terminó
+MAX_CONNECTIONS = 8  # Conexiones simultáneas permitidas contra OfertasB
+PAGE_NUMBER_RE = re.compile(r"pagina=(\d+)")  # Número de página en los enlaces del paginador
+ID_PARAM_RE = re.compile(r"id=(\d+)")  # Parámetro id de productos y categorías
+QUERY_ID_RE = re.compile(r"\?.*id=\d+")  # Enlaces con un id numérico en la query
+PRICE_NUMBER_RE = re.compile(r"[\d\.,]+")  # Parte numérica de un precio
+PRICE_TRANSLATION = str.maketrans({".": None, ",": "."})  # "12.500,00" -> "12500.00"
+# Textos que parecen un precio en colones, en orden de preferencia
+PRICE_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'₡\s?[\d.,]+',  # ₡ seguido de números
+    r'CRC\s?[\d.,]+',  # CRC seguido de números
+    r'colones\s?[\d.,]+',  # "colones" seguido de números
+    r'precio:\s?[\d.,]+',  # "precio:" seguido de números
+))
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36"
+HEADERS = {
+    "User-Agent": USER_AGENT,
+    "Accept": "text/html",
+    # Brotli viene con el extra httpx[brotli] de requirements.txt
+    "Accept-Encoding": "gzip, deflate, br",
+}
+
+
+def _normalize_link(href: str) -> str:
+    """Convertir un enlace relativo del sitio en URL absoluta"""
+    if href.startswith("/"):
+        return f"{BASE_URL}{href}"
+    if not href.startswith("http"):
+        return f"{BASE_URL}/{href}"
+    return href
+
+
+def _id_from_url(url: str) -> Optional[str]:
+    """ID del producto tomado del parámetro id= de su URL"""
+    return url.partition("id=")[2].partition("&")[0] or None
+
+
+def _single_string(node: LexborNode) -> Optional[str]:
+    """Texto del nodo si tiene un único hijo, descendiendo como `.string` de BeautifulSoup"""
+    while True:
+        child = node.child
+        if child is None or child.next is not None:
+            return None
+        if child.is_text_node:
+            return child.text_content
+        node = child
+
+
+def _find_labeled_cell(tree: LexborHTMLParser, label: str) -> Optional[LexborNode]:
+    """Primera celda td/th cuyo texto único contiene `label` (sin distinguir mayúsculas)"""
+    for cell in tree.css("td, th"):
+        text = _single_string(cell)
+        if text and label in text.lower():
+            return cell
+    return None
+
+
+def _next_sibling(node: LexborNode, tags: tuple) -> Optional[LexborNode]:
+    """Siguiente hermano cuya etiqueta está en `tags`, saltando nodos de texto"""
+    sibling = node.next
+    while sibling is not None and sibling.tag not in tags:
+        sibling = sibling.next
+    return sibling
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """Espera antes del siguiente intento: backoff exponencial o el Retry-After de un 429"""
+    backoff = min(2 ** attempt + random.random(), MAX_BACKOFF)
+    response = getattr(error, "response", None) if isinstance(error, httpx.HTTPStatusError) else None
+    if response is not None and response.status_code == 429:
+        try:
+            return min(float(response.headers.get("Retry-After", backoff)), MAX_BACKOFF)
+        except ValueError:
+            # Retry-After también puede venir como fecha HTTP
+            pass
+    return backoff
+
 
 class UncategorizedScraper:
     def __init__(self):
@@ -35,11 +121,23 @@ class UncategorizedScraper:
         print("Inicializando scraper...")
         
         # Inicializar la sesión HTTP con timeout y reintentos
-        self.session = httpx.Client(
+        self.session = httpx.AsyncClient(
             timeout=30.0,
-            headers={"User-Agent": USER_AGENT},
-            follow_redirects=True
+            headers=HEADERS,
+            follow_redirects=True,
+            # Reutilizar una sola conexión HTTP/2 para todos los productos si el servidor lo admite
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_CONNECTIONS,
+                # Mantener las conexiones ociosas durante las pausas entre páginas
+                keepalive_expiry=60
+            )
         )
+        # Limita cuántas páginas se descargan a la vez
+        self._request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        # Espacia las solicitudes de todas las tareas para ser amigable con el servidor
+        self._rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
         
         # Inicializar conexión a Supabase
         self.setup_supabase()
@@ -47,8 +145,11 @@ class UncategorizedScraper:
         # Mapeo para IDs internos de categorías
         self.category_map = {}
         
-        # Cache de productos existentes para evitar duplicados
-        self.existing_products = {}
+        # IDs externos de los productos existentes para evitar duplicados
+        self.existing_products: set = set()
+        
+        # Productos a la espera del próximo insert por lote
+        self._pending = []
         
         # Estadísticas
         self.stats = {
@@ -79,7 +180,7 @@ class UncategorizedScraper:
         """Crear la categoría 'Sin categoría' si no existe"""
         try:
             # Verificar si ya existe la categoría
-            result = self.supabase.table("categories").select("*").eq("name", "Sin categoría").execute()
+            result = self.supabase.table("categories").select("id").eq("name", "Sin categoría").execute()
             
             if result.data:
                 print(f"✅ La categoría 'Sin categoría' ya existe con ID: {result.data[0]['id']}")
@@ -90,7 +191,7 @@ class UncategorizedScraper:
                     "external_id": "uncategorized",
                     "name": "Sin categoría",
                     "source_url": f"{BASE_URL}/productos_cat.asp",
-                    "last_crawled_at": datetime.utcnow().isoformat(),
+                    "last_crawled_at": utc_now_iso(),
                     "seller_id": 1
                 }
                 
@@ -113,20 +214,14 @@ class UncategorizedScraper:
     def load_categories_map(self):
         """Cargar mapa de IDs externos a IDs internos de categorías"""
         try:
-            result = self.supabase.table("categories").select("id, external_id, name").execute()
+            result = self.supabase.table("categories").select("id, external_id").execute()
             
             if not result.data:
                 print("⚠️ No se encontraron categorías en la base de datos")
                 return {}
             
-            # Crear el mapa de IDs
-            self.category_map = {
-                category["external_id"]: {
-                    "id": category["id"],
-                    "name": category["name"]
-                }
-                for category in result.data
-            }
+            # Crear el mapa de IDs (external_id -> id)
+            self.category_map = {category["external_id"]: category["id"] for category in result.data}
             
             print(f"✅ Se cargaron {len(self.category_map)} categorías")
             return self.category_map
@@ -143,8 +238,6 @@ class UncategorizedScraper:
             # Implementamos paginación para obtener todos los productos
             page_size = 1000
             current_page = 0
-            all_products = []
-            total_fetched = 0
             
             while True:
                 # Calcular offset para esta página
@@ -154,13 +247,12 @@ class UncategorizedScraper:
                 result = self.supabase.table("products").select("external_product_id").range(offset, offset + page_size - 1).execute()
                 
                 # Si no hay más datos o la respuesta está vacía, salimos del bucle
-                if not result.data or len(result.data) == 0:
+                if not result.data:
                     break
                 
-                # Agregar los productos de esta página
-                all_products.extend(result.data)
-                total_fetched += len(result.data)
-                print(f"  Cargados {total_fetched} productos ({current_page + 1} páginas)...")
+                # Agregar los IDs de esta página sin acumular las filas
+                self.existing_products.update(str(product["external_product_id"]) for product in result.data)
+                print(f"  Cargados {offset + len(result.data)} productos ({current_page + 1} páginas)...")
                 
                 # Si obtenemos menos del tamaño de página, hemos terminado
                 if len(result.data) < page_size:
@@ -169,37 +261,45 @@ class UncategorizedScraper:
                 # Avanzar a la siguiente página
                 current_page += 1
             
-            if not all_products:
+            if not self.existing_products:
                 print("⚠️ No se encontraron productos existentes")
-                return {}
+                return self.existing_products
             
-            self.existing_products = {str(product["external_product_id"]): True for product in all_products}
             print(f"✅ Se cargaron {len(self.existing_products)} productos existentes")
             return self.existing_products
             
         except Exception as e:
             print(f"❌ Error cargando productos existentes: {str(e)}")
-            return {}
+            return self.existing_products
     
-    def fetch_page(self, url):
+    async def fetch_page(self, url):
         """Obtener el contenido de una página con manejo de errores y esperas"""
         try:
-            # Esperar un tiempo aleatorio para ser amigable con el servidor
-            sleep_time = random.uniform(SLEEP_MIN, SLEEP_MAX)
-            time.sleep(sleep_time)
-            
-            response = self.session.get(url)
-            response.raise_for_status()
+            for attempt in range(FETCH_ATTEMPTS):
+                try:
+                    await self._rate_limiter.acquire()
+                    response = await self.session.get(url)
+                    response.raise_for_status()
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    # Los 4xx (salvo 429) no se arreglan reintentando
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code != 429 and e.response.status_code < 500:
+                        raise
+                    if attempt == FETCH_ATTEMPTS - 1:
+                        raise
+                    delay = _retry_delay(e, attempt)
+                    log.warning("⚠️ Error transitorio en %s (%s), reintentando en %.1fs...", url, e, delay)
+                    await asyncio.sleep(delay)
             
             # Verificar que el contenido parece ser HTML válido
             content = response.text
             if not content or len(content) < 100:
-                print(f"⚠️ La página {url} devolvió contenido muy corto o vacío")
+                log.warning("⚠️ La página %s devolvió contenido muy corto o vacío", url)
             
             return content
             
         except Exception as e:
-            print(f"❌ Error obteniendo la página {url}: {str(e)}")
+            log.error("❌ Error obteniendo la página %s: %s", url, e)
             return None
             
     def debug_page_content(self, html):
@@ -208,7 +308,7 @@ class UncategorizedScraper:
             print("❌ No hay contenido HTML para depurar")
             return
             
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = BeautifulSoup(html, 'lxml')
         
         # Verificar el título
         title = soup.title
@@ -234,26 +334,23 @@ class UncategorizedScraper:
         # Verificar el tamaño del HTML
         print(f"📏 Tamaño del HTML: {len(html)} caracteres")
     
-    def get_total_pages(self):
+    async def get_total_pages(self):
         """Obtener el número total de páginas de productos"""
         try:
-            html = self.fetch_page(f"{BASE_URL}/productos_cat.asp")
+            html = await self.fetch_page(f"{BASE_URL}/productos_cat.asp")
             if not html:
                 return 0
                 
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # Buscar links de paginación
-            pagination_links = soup.find_all("a", href=lambda href: href and "productos_cat.asp" in href and "pagina=" in href)
+            tree = LexborHTMLParser(html)
             
-            max_page = 1
-            for link in pagination_links:
-                href = link.get("href", "")
-                match = re.search(r"pagina=(\d+)", href)
-                if match:
-                    page_num = int(match.group(1))
-                    if page_num > max_page:
-                        max_page = page_num
+            # Buscar links de paginación y quedarse con el número más alto
+            page_numbers = (
+                int(match.group(1))
+                for link in tree.css('a[href*="productos_cat.asp"][href*="pagina="]')
+                for match in (PAGE_NUMBER_RE.search(link.attributes.get("href") or ""),)
+                if match
+            )
+            max_page = max(page_numbers, default=1)
             
             print(f"✅ Total de páginas detectadas: {max_page}")
             return max_page
@@ -269,169 +366,143 @@ class UncategorizedScraper:
             return []
 
         try:
-            soup = BeautifulSoup(page_html, 'html.parser')
+            tree = LexborHTMLParser(page_html)
             
             # Análisis de depuración básico del HTML
             html_size = len(page_html)
-            print(f"📊 Tamaño del HTML recibido: {html_size} bytes")
+            log.debug("📊 Tamaño del HTML recibido: %s bytes", html_size)
 
             if html_size < 5000:
-                print("⚠️ El HTML es muy pequeño, posiblemente es una página de error o redirección")
+                log.warning("⚠️ El HTML es muy pequeño, posiblemente es una página de error o redirección")
                 self.debug_page_content(page_html)
                 
                 # Guardar HTML para análisis
                 with open(f"debug_page_{int(time.time())}.html", 'w', encoding='utf-8') as f:
                     f.write(page_html)
-                print("💾 Se ha guardado el HTML para análisis")
+                log.warning("💾 Se ha guardado el HTML para análisis")
                 return []
                 
-            # Buscar enlaces a productos de diferentes maneras
-            product_links = []
+            # Buscar enlaces a productos de diferentes maneras, sin duplicados
+            product_links = set()
             
             # Método 1: Enlaces directos a productos_det.asp (principal)
-            direct_links = soup.find_all("a", href=lambda href: href and "productos_det.asp" in href)
-            print(f"Método 1: Encontrados {len(direct_links)} enlaces directos a productos_det.asp")
+            direct_links = tree.css('a[href*="productos_det.asp"]')
+            log.debug("Método 1: Encontrados %s enlaces directos a productos_det.asp", len(direct_links))
             
-            for a_tag in direct_links:
-                href = a_tag.get("href", "")
-                if href.startswith("/"):
-                    href = f"{BASE_URL}{href}"
-                elif not href.startswith("http"):
-                    href = f"{BASE_URL}/{href}"
-                product_links.append(href)
+            product_links.update(_normalize_link(a_tag.attributes.get("href") or "") for a_tag in direct_links)
             
             # Método 2: Buscar en tablas (común en sitios más antiguos)
             if len(product_links) < 5:  # Si encontramos muy pocos productos, buscar más
-                tables = soup.find_all("table")
-                table_links = []
-                
-                for table in tables:
-                    # Buscar enlaces dentro de las tablas
-                    for a_tag in table.find_all("a", href=lambda href: href and ("productos_det.asp" in href or "id=" in href)):
-                        href = a_tag.get("href", "")
-                        if "productos_det.asp" in href:
-                            if href.startswith("/"):
-                                href = f"{BASE_URL}{href}"
-                            elif not href.startswith("http"):
-                                href = f"{BASE_URL}/{href}"
-                            table_links.append(href)
+                table_links = [
+                    _normalize_link(a_tag.attributes.get("href") or "")
+                    for a_tag in tree.css('table a[href*="productos_det.asp"]')
+                ]
                 
-                print(f"Método 2: Encontrados {len(table_links)} enlaces en tablas")
-                product_links.extend(table_links)
+                log.debug("Método 2: Encontrados %s enlaces en tablas", len(table_links))
+                product_links.update(table_links)
             
             # Método 3: Buscar en divs con clases específicas
-            product_divs = soup.find_all("div", class_=lambda cls: cls and ("product" in cls.lower() or "item" in cls.lower()))
             div_links = []
             
-            for div in product_divs:
-                for a_tag in div.find_all("a", href=True):
-                    href = a_tag.get("href", "")
+            for div in tree.css("div[class]"):
+                cls = (div.attributes.get("class") or "").lower()
+                if "product" not in cls and "item" not in cls:
+                    continue
+                for a_tag in div.css("a[href]"):
+                    href = a_tag.attributes.get("href") or ""
                     # Si parece un enlace a un producto
-                    if "productos_det.asp" in href or re.search(r'id=\d+', href):
-                        if href.startswith("/"):
-                            href = f"{BASE_URL}{href}"
-                        elif not href.startswith("http"):
-                            href = f"{BASE_URL}/{href}"
-                        div_links.append(href)
+                    if "productos_det.asp" in href or ID_PARAM_RE.search(href):
+                        div_links.append(_normalize_link(href))
             
-            print(f"Método 3: Encontrados {len(div_links)} enlaces en divs de productos")
-            product_links.extend(div_links)
+            log.debug("Método 3: Encontrados %s enlaces en divs de productos", len(div_links))
+            product_links.update(div_links)
             
             # Método 4: Buscar por contenido de imagen y texto
             potential_product_links = []
+            product_keywords = ["comprar", "precio", "oferta", "producto", "detalles"]
             
-            for a_tag in soup.find_all("a", href=lambda href: href and ("productos_det.asp" in href or "id=" in href)):
+            for a_tag in tree.css('a[href*="productos_det.asp"], a[href*="id="]'):
                 # Los enlaces a productos suelen tener imágenes o textos de producto
-                has_img = a_tag.find("img") is not None
-                text_content = a_tag.text.strip().lower()
+                has_img = a_tag.css_first("img") is not None
+                text_content = a_tag.text().strip().lower()
                 
                 # Palabras clave que sugieren que es un producto
-                product_keywords = ["comprar", "precio", "oferta", "producto", "detalles"]
                 has_keyword = any(keyword in text_content for keyword in product_keywords)
                 
                 if has_img or has_keyword:
-                    href = a_tag.get("href", "")
-                    if href.startswith("/"):
-                        href = f"{BASE_URL}{href}"
-                    elif not href.startswith("http"):
-                        href = f"{BASE_URL}/{href}"
-                    potential_product_links.append(href)
+                    potential_product_links.append(_normalize_link(a_tag.attributes.get("href") or ""))
             
-            print(f"Método 4: Encontrados {len(potential_product_links)} enlaces potenciales por contenido")
-            product_links.extend(potential_product_links)
+            log.debug("Método 4: Encontrados %s enlaces potenciales por contenido", len(potential_product_links))
+            product_links.update(potential_product_links)
             
             # Método 5: Último recurso - cualquier enlace con parámetros de ID
             if len(product_links) < 5:
                 id_links = []
-                for a_tag in soup.find_all("a", href=lambda href: href and re.search(r'\?.*id=\d+', href or "")):
-                    href = a_tag.get("href", "")
+                for a_tag in tree.css('a[href*="id="]'):
+                    href = a_tag.attributes.get("href") or ""
+                    if not QUERY_ID_RE.search(href):
+                        continue
                     # Ignorar enlaces obvios de paginación o categorías
                     if "pagina=" in href and "productos_det.asp" not in href:
                         continue
                         
-                    if href.startswith("/"):
-                        href = f"{BASE_URL}{href}"
-                    elif not href.startswith("http"):
-                        href = f"{BASE_URL}/{href}"
-                    id_links.append(href)
+                    id_links.append(_normalize_link(href))
                 
-                print(f"Método 5: Encontrados {len(id_links)} enlaces con parámetros ID")
-                product_links.extend(id_links)
+                log.debug("Método 5: Encontrados %s enlaces con parámetros ID", len(id_links))
+                product_links.update(id_links)
             
-            # Eliminar duplicados
-            unique_links = list(set(product_links))
+            unique_links = list(product_links)
             
             # Imprimir ejemplos para depuración
             if unique_links:
-                print(f"📌 Ejemplos de enlaces encontrados ({len(unique_links)} total):")
+                log.debug("📌 Ejemplos de enlaces encontrados (%s total):", len(unique_links))
                 for i, link in enumerate(unique_links[:5]):
-                    print(f"  {i+1}. {link}")
+                    log.debug("  %s. %s", i+1, link)
                 if len(unique_links) > 5:
-                    print(f"  ... y {len(unique_links) - 5} más")
+                    log.debug("  ... y %s más", len(unique_links) - 5)
             else:
-                print("⚠️ No se encontraron enlaces de productos usando ningún método")
+                log.warning("⚠️ No se encontraron enlaces de productos usando ningún método")
                 self.debug_page_content(page_html)
                 
                 # Guardar HTML para análisis más detallado
                 with open(f"debug_page_{int(time.time())}.html", 'w', encoding='utf-8') as f:
                     f.write(page_html)
-                print("💾 Se ha guardado el HTML para análisis detallado")
+                log.warning("💾 Se ha guardado el HTML para análisis detallado")
             
             return unique_links
             
         except Exception as e:
-            print(f"❌ Error extrayendo enlaces de productos: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("❌ Error extrayendo enlaces de productos: %s", e)
             return []
     
-    def process_product_page(self, url):
+    async def process_product_page(self, url):
         """Procesar la página de un producto individual"""
         try:
-            print(f"Procesando producto: {url}")
-            html = self.fetch_page(url)
-            if not html:
-                self.stats["errors"] += 1
-                return None
-                
-            soup = BeautifulSoup(html, 'html.parser')
+            log.debug("Procesando producto: %s", url)
             
-            # Extraer ID del producto
-            product_id = None
-            if "id=" in url:
-                product_id = url.split("id=")[1].split("&")[0]
+            # Extraer ID del producto de la URL, antes de descargar nada
+            product_id = _id_from_url(url)
             
             if not product_id:
-                print(f"⚠️ No se pudo determinar el ID del producto para {url}")
+                log.warning("⚠️ No se pudo determinar el ID del producto para %s", url)
                 self.stats["errors"] += 1
                 return None
             
             # Verificar si ya existe
             if product_id in self.existing_products:
                 self.stats["existing_products"] += 1
-                print(f"✅ Producto {product_id} ya existe en la base de datos")
+                log.debug("✅ Producto %s ya existe en la base de datos", product_id)
                 return None
             
+            html = await self.fetch_page(url)
+            if not html:
+                self.stats["errors"] += 1
+                return None
+                
+            tree = LexborHTMLParser(html)
+            # El texto de scripts y estilos no forma parte del texto visible de la página
+            tree.strip_tags(["script", "style"])
+            
             # Extraer nombre del producto
             name = None
             # Intentar varios selectores para el nombre
@@ -444,25 +515,25 @@ class UncategorizedScraper:
                 ".product-info h1",
                 ".product-details h2"
             ]:
-                name_elem = soup.select_one(selector)
+                name_elem = tree.css_first(selector)
                 if name_elem:
-                    name = name_elem.text.strip()
-                    print(f"Nombre encontrado con selector '{selector}': {name}")
+                    name = name_elem.text().strip()
+                    log.debug("Nombre encontrado con selector '%s': %s", selector, name)
                     break
                     
             if not name:
                 # Buscar por texto en negrita que podría ser un título
-                bold_elems = soup.find_all(['b', 'strong'])
+                bold_elems = tree.css('b, strong')
                 for elem in bold_elems:
-                    if len(elem.text.strip()) > 10:  # Suficientemente largo para ser un título
-                        name = elem.text.strip()
-                        print(f"Nombre encontrado en elemento bold: {name}")
+                    if len(elem.text().strip()) > 10:  # Suficientemente largo para ser un título
+                        name = elem.text().strip()
+                        log.debug("Nombre encontrado en elemento bold: %s", name)
                         break
                         
             # Si todavía no se ha encontrado, usar un fallback
             if not name:
                 name = "Producto sin nombre"
-                print(f"⚠️ No se pudo encontrar el nombre del producto {product_id}")
+                log.debug("⚠️ No se pudo encontrar el nombre del producto %s", product_id)
             
             # Extraer precio usando múltiples estrategias
             price_raw = None
@@ -470,92 +541,86 @@ class UncategorizedScraper:
             currency = "CRC"  # Por defecto, colones costarricenses
             
             # Método 1: Buscar en div.price
-            price_elem = soup.find("div", class_="price")
+            price_elem = tree.css_first("div.price")
             if price_elem:
-                price_raw = price_elem.text.strip()
-                print(f"Precio encontrado (div.price): {price_raw}")
+                price_raw = price_elem.text().strip()
+                log.debug("Precio encontrado (div.price): %s", price_raw)
                 
             # Método 2: Buscar en span.price
             if not price_raw:
-                price_span = soup.find("span", class_="price")
+                price_span = tree.css_first("span.price")
                 if price_span:
-                    price_raw = price_span.text.strip()
-                    print(f"Precio encontrado (span.price): {price_raw}")
+                    price_raw = price_span.text().strip()
+                    log.debug("Precio encontrado (span.price): %s", price_raw)
             
             # Método 3: Buscar tabla con información de precio
             if not price_raw:
-                price_label = soup.find(["td", "th"], string=lambda s: s and "precio" in s.lower())
+                price_label = _find_labeled_cell(tree, "precio")
                 if price_label:
-                    next_cell = price_label.find_next_sibling("td")
+                    next_cell = _next_sibling(price_label, ("td",))
                     if next_cell:
-                        price_raw = next_cell.text.strip()
-                        print(f"Precio encontrado (tabla): {price_raw}")
+                        price_raw = next_cell.text().strip()
+                        log.debug("Precio encontrado (tabla): %s", price_raw)
                         
             # Método 4: Buscar cualquier texto que parezca un precio en colones
             if not price_raw:
-                price_patterns = [
-                    r'₡\s?[\d.,]+',  # ₡ seguido de números
-                    r'CRC\s?[\d.,]+',  # CRC seguido de números
-                    r'colones\s?[\d.,]+',  # "colones" seguido de números
-                    r'precio:\s?[\d.,]+',  # "precio:" seguido de números
-                ]
-                
-                for pattern in price_patterns:
-                    match = re.search(pattern, html, re.IGNORECASE)
+                for pattern in PRICE_PATTERNS:
+                    match = pattern.search(html)
                     if match:
                         price_raw = match.group(0).strip()
-                        print(f"Precio encontrado (regex): {price_raw}")
+                        log.debug("Precio encontrado (regex): %s", price_raw)
                         break
             
             # Extraer valor numérico del precio
             if price_raw:
                 # Intentar extraer el valor numérico
-                price_match = re.search(r'[\d\.,]+', price_raw)
+                price_match = PRICE_NUMBER_RE.search(price_raw)
                 if price_match:
-                    price_str = price_match.group(0).replace(".", "").replace(",", ".")
+                    price_str = price_match.group(0).translate(PRICE_TRANSLATION)
                     try:
                         price_numeric = float(price_str)
-                        print(f"Precio numérico extraído: {price_numeric}")
+                        log.debug("Precio numérico extraído: %s", price_numeric)
                     except ValueError:
                         price_numeric = None
-                        print(f"⚠️ No se pudo convertir {price_str} a número")
+                        log.debug("⚠️ No se pudo convertir %s a número", price_str)
             
             # Extraer imagen usando múltiples estrategias
             image_url = None
             
             # Método 1: Buscar en div#content
-            main_content = soup.find('div', {'id': 'content'})
+            main_content = tree.css_first('div#content')
             if main_content:
-                img = main_content.find('img', src=lambda x: x and ('upload' in x or 'images' in x))
-                if img and img.get('src'):
-                    image_url = img['src']
-                    print(f"Imagen encontrada (content): {image_url}")
+                for img in main_content.css('img[src]'):
+                    src = img.attributes.get('src')
+                    if src and ('upload' in src or 'images' in src):
+                        image_url = src
+                        log.debug("Imagen encontrada (content): %s", image_url)
+                        break
             
             # Método 2: Buscar en div.product-image
             if not image_url:
-                product_image_div = soup.find('div', class_='product-image')
+                product_image_div = tree.css_first('div.product-image')
                 if product_image_div:
-                    img = product_image_div.find('img', src=True)
+                    img = product_image_div.css_first('img[src]')
                     if img:
-                        image_url = img['src']
-                        print(f"Imagen encontrada (product-image): {image_url}")
+                        image_url = img.attributes.get('src')
+                        log.debug("Imagen encontrada (product-image): %s", image_url)
             
             # Método 3: Buscar imágenes grandes que puedan ser de producto
             if not image_url:
-                all_images = soup.find_all('img', src=True)
-                product_images = [img for img in all_images if any(term in img.get('src', '') for term in 
+                all_images = [img.attributes.get('src') or '' for img in tree.css('img[src]')]
+                product_images = [src for src in all_images if any(term in src for term in 
                                  ['product', 'prod', 'item', 'foto', 'image', 'img', 'upload'])]
                 
                 if product_images:
                     # Ordenar por tamaño del src (generalmente las imágenes de producto tienen URLs más largas)
-                    product_images.sort(key=lambda img: len(img.get('src', '')), reverse=True)
-                    image_url = product_images[0]['src']
-                    print(f"Imagen encontrada (por nombre): {image_url}")
+                    product_images.sort(key=len, reverse=True)
+                    image_url = product_images[0]
+                    log.debug("Imagen encontrada (por nombre): %s", image_url)
                 elif all_images:
                     # Si no encontramos imágenes específicas de producto, usar la más grande
-                    largest_img = max(all_images, key=lambda img: len(img.get('src', '')))
-                    image_url = largest_img['src']
-                    print(f"Imagen encontrada (la más grande): {image_url}")
+                    image_url = max(all_images, key=len)
+                    log.debug("Imagen encontrada (la más grande): %s", image_url)
             
             # Normalizar URL de imagen
             if image_url:
@@ -563,7 +628,7 @@ class UncategorizedScraper:
                     image_url = f"{BASE_URL}{image_url}"
                 elif not image_url.startswith('http'):
                     image_url = f"{BASE_URL}/{image_url}"
-                print(f"URL de imagen normalizada: {image_url}")
+                log.debug("URL de imagen normalizada: %s", image_url)
             
             # VERIFICACIÓN DE CATEGORÍA - PARTE CRÍTICA
             is_uncategorized = False
@@ -571,62 +636,65 @@ class UncategorizedScraper:
             category_name = None
             
             # Método 1: Buscar por texto "Categoría" en tablas
-            category_info = soup.find(["td", "th"], string=lambda s: s and "categoría" in s.lower())
+            category_info = _find_labeled_cell(tree, "categoría")
             if category_info:
-                print("Encontrada referencia a 'Categoría' en una tabla")
+                log.debug("Encontrada referencia a 'Categoría' en una tabla")
                 # Encontrar el valor correspondiente
-                category_value = category_info.find_next_sibling(["td", "th"])
+                category_value = _next_sibling(category_info, ("td", "th"))
                 if category_value:
-                    category_text = category_value.text.strip().lower()
-                    print(f"Texto de categoría encontrado: '{category_text}'")
+                    category_text = category_value.text().strip().lower()
+                    log.debug("Texto de categoría encontrado: '%s'", category_text)
                     
                     # Verificar si es "sin categoría"
                     if "sin categoría" in category_text or "sin categoria" in category_text:
                         is_uncategorized = True
-                        print("✅ PRODUCTO SIN CATEGORÍA ENCONTRADO!")
+                        log.debug("✅ PRODUCTO SIN CATEGORÍA ENCONTRADO!")
                     
                     # Intentar extraer el ID de categoría de la URL si existe
-                    category_link = category_value.find("a", href=lambda href: href and "productos_cat.asp" in href)
+                    category_link = category_value.css_first('a[href*="productos_cat.asp"]')
                     if category_link:
-                        href = category_link.get("href", "")
-                        match = re.search(r"id=(\d+)", href)
+                        href = category_link.attributes.get("href") or ""
+                        match = ID_PARAM_RE.search(href)
                         if match:
                             category_id = match.group(1)
-                            print(f"ID de categoría extraído de la URL: {category_id}")
+                            log.debug("ID de categoría extraído de la URL: %s", category_id)
                             
                     # Capturar el nombre de la categoría
-                    category_name = category_value.get_text(strip=True)
+                    category_name = category_value.text(strip=True)
             
             # Método 2: Buscar directamente texto "sin categoría" en la página
             if not is_uncategorized:
                 # Buscar en el texto completo de la página
-                page_text = soup.get_text().lower()
+                page_text = tree.root.text().lower()
                 if "sin categoría" in page_text or "sin categoria" in page_text:
                     is_uncategorized = True
-                    print("✅ Texto 'sin categoría' encontrado en la página!")
+                    log.debug("✅ Texto 'sin categoría' encontrado en la página!")
                 
                 # Buscar en elementos específicos que podrían contener la categoría
-                category_elements = soup.select(".category, .product-category, .breadcrumb")
+                category_elements = tree.css(".category, .product-category, .breadcrumb")
                 for elem in category_elements:
-                    elem_text = elem.get_text().lower()
+                    elem_text = elem.text().lower()
                     if "sin categoría" in elem_text or "sin categoria" in elem_text:
                         is_uncategorized = True
-                        print(f"✅ 'Sin categoría' encontrado en elemento {elem.name}.{elem.get('class', '')}")
+                        log.debug("✅ 'Sin categoría' encontrado en elemento %s.%s", elem.tag, elem.attributes.get('class', ''))
                         break
             
             # Método 3: Buscar breadcrumb de navegación
             if not category_id and not is_uncategorized:
-                breadcrumbs = soup.find_all(["div", "nav", "ul"], class_=lambda c: c and "breadcrumb" in c.lower())
+                breadcrumbs = [
+                    elem for elem in tree.css("div[class], nav[class], ul[class]")
+                    if "breadcrumb" in (elem.attributes.get("class") or "").lower()
+                ]
                 for breadcrumb in breadcrumbs:
-                    links = breadcrumb.find_all("a")
+                    links = breadcrumb.css("a")
                     for link in links:
-                        href = link.get("href", "")
+                        href = link.attributes.get("href") or ""
                         if "categoria" in href.lower() or "productos_cat.asp" in href.lower():
-                            match = re.search(r"id=(\d+)", href)
+                            match = ID_PARAM_RE.search(href)
                             if match:
                                 category_id = match.group(1)
-                                category_name = link.text.strip()
-                                print(f"Categoría encontrada en breadcrumb: {category_name} (ID: {category_id})")
+                                category_name = link.text().strip()
+                                log.debug("Categoría encontrada en breadcrumb: %s (ID: %s)", category_name, category_id)
                                 break
             
             # Si después de todo no se encontró categoría explícita, verificar si tiene marcadores
@@ -640,14 +708,15 @@ class UncategorizedScraper:
                     "categoría: ninguna"
                 ]
                 
-                page_text = soup.get_text().lower()
+                page_text = tree.root.text().lower()
                 for marker in uncategorized_markers:
                     if marker in page_text:
                         is_uncategorized = True
-                        print(f"✅ Marcador de producto sin categoría encontrado: '{marker}'")
+                        log.debug("✅ Marcador de producto sin categoría encontrado: '%s'", marker)
                         break
             
-            # Crear datos del producto
+            # Crear datos del producto (visto por primera y última vez en este mismo instante)
+            now_iso = utc_now_iso()
             product_data = {
                 "external_product_id": product_id,
                 "name": name,
@@ -656,32 +725,31 @@ class UncategorizedScraper:
                 "price_raw": price_raw,
                 "price_numeric": price_numeric,
                 "currency": currency,
-                "first_seen_at": datetime.utcnow().isoformat(),
-                "last_seen_at": datetime.utcnow().isoformat(),
+                "first_seen_at": now_iso,
+                "last_seen_at": now_iso,
                 "seller_id": 1,
-                "source_html": html,  # Guardar HTML completo para procesamiento futuro
             }
             
             # Asignar categoría basado en nuestro análisis
             if is_uncategorized:
                 product_data["category_id"] = self.uncategorized_category["id"]
                 self.stats["uncategorized_products"] += 1
-                print(f"🎯 Producto {product_id} confirmado como 'Sin categoría'")
+                log.debug("🎯 Producto %s confirmado como 'Sin categoría'", product_id)
                 
                 # Guardar una copia del HTML para análisis (solo si es sin categoría, para optimizar espacio)
                 with open(f"uncategorized_product_{product_id}.html", 'w', encoding='utf-8') as f:
                     f.write(html)
-                print(f"💾 Guardado HTML de producto sin categoría: {product_id}")
+                log.debug("💾 Guardado HTML de producto sin categoría: %s", product_id)
                 
             elif category_id and category_id in self.category_map:
                 # Este producto tiene una categoría válida, lo ignoramos para este scraper específico
-                print(f"⏭️ Producto {product_id} tiene categoría asignada: {self.category_map[category_id]['name']}")
+                log.debug("⏭️ Producto %s tiene categoría asignada: %s", product_id, category_name or category_id)
                 return None
             else:
                 # No pudimos determinar si es sin categoría o no, por lo tanto lo consideramos sin categoría
                 product_data["category_id"] = self.uncategorized_category["id"]
                 self.stats["uncategorized_products"] += 1
-                print(f"🔍 Producto {product_id} sin categoría clara, asignado a 'Sin categoría'")
+                log.debug("🔍 Producto %s sin categoría clara, asignado a 'Sin categoría'", product_id)
             
             # Actualizar estadísticas solo si vamos a guardarlo (es decir, si es sin categoría)
             self.stats["total_products"] += 1
@@ -690,38 +758,56 @@ class UncategorizedScraper:
             return product_data
             
         except Exception as e:
-            print(f"❌ Error procesando producto {url}: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            log.exception("❌ Error procesando producto %s: %s", url, e)
             self.stats["errors"] += 1
             return None
     
     def save_product(self, product_data):
-        """Guardar un producto en Supabase"""
+        """Encolar un producto para guardarlo en Supabase en el próximo lote"""
         if not product_data:
             return False
             
+        # Marcarlo como existente desde ya para no procesarlo otra vez antes del insert
+        self.existing_products.add(product_data["external_product_id"])
+        self._pending.append(product_data)
+        
+        if len(self._pending) >= INSERT_BATCH_SIZE:
+            self.flush()
+        return True
+    
+    def flush(self):
+        """Insertar en Supabase los productos pendientes con una sola solicitud"""
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        
         try:
-            # Quitar el HTML completo para el upsert (lo guardamos separado)
-            html_content = product_data.pop("source_html", None)
-            
-            # Insertar el producto
-            result = self.supabase.table("products").insert(product_data).execute()
-            
-            if not result.data:
-                print(f"❌ Error guardando producto {product_data.get('external_product_id')}")
-                return False
-                
-            # Marcar como existente en nuestro cache
-            self.existing_products[product_data["external_product_id"]] = True
-            
-            return True
-            
+            # POST directo a PostgREST: orjson serializa el lote mucho más rápido que json,
+            # y return=minimal evita que nos devuelva todas las filas insertadas
+            response = self.supabase.postgrest.session.post(
+                "/products",
+                content=orjson.dumps(batch),
+                headers={"Content-Type": "application/json", "Prefer": "return=minimal"}
+            )
+            response.raise_for_status()
+            log.info("💾 Lote de %s productos guardado", len(batch))
+            return
         except Exception as e:
-            print(f"❌ Error guardando producto {product_data.get('external_product_id')}: {str(e)}")
-            return False
+            # Un producto inválido hace fallar todo el lote: reintentar uno por uno
+            log.warning("⚠️ Error en el insert por lote de %s productos: %s. Reintentando uno por uno...", len(batch), e)
+        
+        for product_data in batch:
+            try:
+                result = self.supabase.table("products").insert(product_data).execute()
+                if result.data:
+                    continue
+                log.error("❌ Error guardando producto %s", product_data.get('external_product_id'))
+            except Exception as e:
+                log.error("❌ Error guardando producto %s: %s", product_data.get('external_product_id'), e)
+            # No quedó guardado: permitir procesarlo de nuevo
+            self.existing_products.discard(product_data["external_product_id"])
     
-    def run(self, page_limit=None, start_page=1, debug_mode=False):
+    async def run(self, page_limit=None, start_page=1, debug_mode=False):
         """Ejecutar el scraper completo
         
         Args:
@@ -746,7 +832,7 @@ class UncategorizedScraper:
             self.load_existing_products()
             
             # Obtener el número total de páginas
-            total_pages = self.get_total_pages()
+            total_pages = await self.get_total_pages()
             if total_pages == 0:
                 print("❌ No se pudieron detectar las páginas. Abortando.")
                 return
@@ -763,82 +849,108 @@ class UncategorizedScraper:
             print(f"\n🚀 Procesando {total_pages_to_process} páginas (de {start_page} a {end_page})")
             
             # Configurar barra de progreso para las páginas
-            page_progress = tqdm.tqdm(total=total_pages_to_process, desc="Procesando páginas", unit="página")
+            page_progress = tqdm.tqdm(total=total_pages_to_process, desc="Descargando páginas", unit="página")
+            
+            async def fetch_listing(page_num):
+                async with self._request_semaphore:
+                    page_html = await self.fetch_page(f"{BASE_URL}/productos_cat.asp?pagina={page_num}")
+                page_progress.update(1)
+                return page_html
             
             # Variables de control para detección de problemas
             consecutive_empty_pages = 0
             max_consecutive_empty = 5  # Detener después de 5 páginas consecutivas sin productos
-            
-            # Procesar cada página
-            for page_num in range(start_page, end_page + 1):
-                page_url = f"{BASE_URL}/productos_cat.asp?pagina={page_num}"
-                print(f"\n{'='*40}")
-                print(f"🌐 PÁGINA {page_num}/{end_page}: {page_url}")
-                print(f"{'='*40}")
-                
-                page_html = self.fetch_page(page_url)
-                if not page_html:
-                    page_progress.update(1)
-                    consecutive_empty_pages += 1
-                    print(f"⚠️ Página {page_num} sin contenido ({consecutive_empty_pages} consecutivas)")
+            all_links = set()
+            listing_done = False
+            
+            # Descargar los listados en paralelo por tandas: así las páginas vacías del final
+            # cortan el recorrido antes de pedir las siguientes
+            page_nums = range(start_page, end_page + 1)
+            for window_start in range(0, len(page_nums), LISTING_WINDOW):
+                window = page_nums[window_start:window_start + LISTING_WINDOW]
+                listing_htmls = await asyncio.gather(*(fetch_listing(page_num) for page_num in window))
+                
+                # Extraer los enlaces de cada página, en orden
+                for page_num, page_html in zip(window, listing_htmls):
+                    page_url = f"{BASE_URL}/productos_cat.asp?pagina={page_num}"
+                    log.debug("🌐 PÁGINA %s/%s: %s", page_num, end_page, page_url)
                     
-                    if consecutive_empty_pages >= max_consecutive_empty:
-                        print(f"⛔ {max_consecutive_empty} páginas consecutivas sin contenido. Finalizando.")
-                        break
+                    if not page_html:
+                        consecutive_empty_pages += 1
+                        log.warning("⚠️ Página %s sin contenido (%s consecutivas)", page_num, consecutive_empty_pages)
                         
-                    continue
-                
-                # Análisis previo del HTML
-                if debug_mode:
-                    print("\n🔬 Análisis previo del HTML de la página:")
-                    self.debug_page_content(page_html)
-                
-                # Extraer links a productos
-                product_links = self.extract_product_links(page_html)
-                
-                if product_links:
-                    consecutive_empty_pages = 0  # Reiniciar contador si encontramos productos
-                    print(f"✅ Encontrados {len(product_links)} productos en página {page_num}")
-                else:
-                    consecutive_empty_pages += 1
-                    print(f"⚠️ No se encontraron productos en página {page_num} ({consecutive_empty_pages} consecutivas)")
-                    
-                    # Si tenemos demasiadas páginas consecutivas sin productos, algo puede estar mal
-                    if consecutive_empty_pages >= max_consecutive_empty:
-                        print(f"⛔ {max_consecutive_empty} páginas consecutivas sin productos. Finalizando.")
+                        if consecutive_empty_pages >= max_consecutive_empty:
+                            log.warning("⛔ %s páginas consecutivas sin contenido. Finalizando.", max_consecutive_empty)
+                            listing_done = True
+                            break
                         
-                        # Guardar última página para análisis
-                        with open(f"debug_empty_page_{page_num}.html", 'w', encoding='utf-8') as f:
-                            f.write(page_html)
-                        print(f"💾 Guardada página vacía para análisis: debug_empty_page_{page_num}.html")
+                        continue
+                    
+                    # Análisis previo del HTML
+                    if debug_mode:
+                        print("\n🔬 Análisis previo del HTML de la página:")
+                        self.debug_page_content(page_html)
+                    
+                    # Extraer links a productos
+                    product_links = self.extract_product_links(page_html)
+                    
+                    if product_links:
+                        consecutive_empty_pages = 0  # Reiniciar contador si encontramos productos
+                        log.info("✅ Encontrados %s productos en página %s", len(product_links), page_num)
+                        all_links.update(product_links)
+                    else:
+                        consecutive_empty_pages += 1
+                        log.warning("⚠️ No se encontraron productos en página %s (%s consecutivas)", page_num, consecutive_empty_pages)
                         
-                        break
+                        # Si tenemos demasiadas páginas consecutivas sin productos, algo puede estar mal
+                        if consecutive_empty_pages >= max_consecutive_empty:
+                            log.warning("⛔ %s páginas consecutivas sin productos. Finalizando.", max_consecutive_empty)
+                            
+                            # Guardar última página para análisis
+                            with open(f"debug_empty_page_{page_num}.html", 'w', encoding='utf-8') as f:
+                                f.write(page_html)
+                            log.warning("💾 Guardada página vacía para análisis: debug_empty_page_%s.html", page_num)
+                            
+                            listing_done = True
+                            break
                 
-                # Procesar cada producto
-                if product_links:
-                    product_progress = tqdm.tqdm(total=len(product_links), desc=f"Productos en página {page_num}", unit="producto")
-                    uncategorized_in_page = 0
+                if listing_done:
+                    break
+            
+            page_progress.close()
+
+            # Los productos que ya están en la base de datos no se descargan
+            known_links = {url for url in all_links if _id_from_url(url) in self.existing_products}
+            if known_links:
+                self.stats["existing_products"] += len(known_links)
+                log.info("⏭️ %s productos ya existen en la base de datos, no se descargan", len(known_links))
+                all_links -= known_links
+            
+            # Procesar todos los productos encontrados en paralelo
+            if all_links:
+                product_progress = tqdm.tqdm(total=len(all_links), desc="Procesando productos", unit="producto")
+                uncategorized_found = 0
+                
+                async def process(product_url):
+                    async with self._request_semaphore:
+                        return await self.process_product_page(product_url)
+                
+                # Guardar cada producto apenas termina, para que los lotes se vayan insertando
+                for next_product in asyncio.as_completed([process(product_url) for product_url in all_links]):
+                    product_data = await next_product
                     
-                    for product_url in product_links:
-                        # Procesar producto
-                        product_data = self.process_product_page(product_url)
-                        
-                        # Guardar si es válido (sin categoría)
-                        if product_data:
-                            self.save_product(product_data)
-                            uncategorized_in_page += 1
-                        
-                        product_progress.update(1)
+                    # Guardar si es válido (sin categoría)
+                    if product_data:
+                        self.save_product(product_data)
+                        uncategorized_found += 1
                     
-                    product_progress.close()
-                    print(f"📊 Resumen de la página {page_num}: {uncategorized_in_page} productos sin categoría de {len(product_links)} totales")
-                
-                page_progress.update(1)
+                    product_progress.update(1)
                 
-                # Pequeña pausa entre páginas para evitar sobrecargar el servidor
-                time.sleep(random.uniform(1.5, 3.0))
+                product_progress.close()
+                print(f"📊 Resumen: {uncategorized_found} productos sin categoría de {len(all_links)} totales")
             
-            page_progress.close()
+            # Guardar los productos que quedaron en el último lote
+            self.flush()
             
             # Duración total
             duration = time.time() - start_time
@@ -862,12 +974,15 @@ class UncategorizedScraper:
             import traceback
             traceback.print_exc()
     
-    def close(self):
+    async def close(self):
         """Cerrar la sesión y liberar recursos"""
+        # Guardar lo pendiente si la ejecución se interrumpió antes del último lote
+        if getattr(self, '_pending', None):
+            self.flush()
         if hasattr(self, 'session'):
-            self.session.close()
+            await self.session.aclose()
 
-def main():
+async def main():
     """Función principal"""
     parser = argparse.ArgumentParser(description="Scrapear productos sin categoría de OfertasB")
     parser.add_argument("--limit", type=int, help="Límite de páginas a procesar (para pruebas)")
@@ -875,12 +990,15 @@ def main():
     parser.add_argument("--debug", action="store_true", help="Activar modo de depuración")
     args = parser.parse_args()
     
+    # El detalle por producto solo se muestra con LOG_LEVEL=DEBUG o INFO
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), format='%(message)s')
+    
     scraper = UncategorizedScraper()
     
     try:
-        scraper.run(page_limit=args.limit, start_page=args.start, debug_mode=args.debug)
+        await scraper.run(page_limit=args.limit, start_page=args.start, debug_mode=args.debug)
     finally:
-        scraper.close()
+        await scraper.close()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
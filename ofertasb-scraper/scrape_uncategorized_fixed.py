@@ -23,6 +23,7 @@ import base64
 import io
 import uuid
 from utils.price import parse_price
+from utils.dates import utc_now_iso
 
 # Cargar variables de entorno
 load_dotenv()
@@ -100,7 +101,7 @@ class UncategorizedScraper:
                     "external_id": "uncategorized",
                     "name": "Sin categoría",
                     "source_url": f"{BASE_URL}/productos_cat.asp",
-                    "last_crawled_at": datetime.utcnow().isoformat(),
+                    "last_crawled_at": utc_now_iso(),
                     "seller_id": 1
                 }
                 
@@ -232,7 +233,7 @@ class UncategorizedScraper:
             if not html:
                 return 0
                 
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = BeautifulSoup(html, 'lxml')
             
             # Buscar enlaces de paginación
             pagination_links = soup.find_all("a", href=lambda href: href and "pagina=" in href)
@@ -266,7 +267,7 @@ class UncategorizedScraper:
             return []
 
         try:
-            soup = BeautifulSoup(page_html, 'html.parser')
+            soup = BeautifulSoup(page_html, 'lxml')
             
             # Análisis de depuración básico del HTML
             html_size = len(page_html)
@@ -403,7 +404,7 @@ class UncategorizedScraper:
                 self.stats["errors"] += 1
                 return None
                 
-            soup = BeautifulSoup(html, 'html.parser')
+            soup = BeautifulSoup(html, 'lxml')
             
             # Extraer ID del producto
             product_id = None
@@ -785,8 +786,8 @@ class UncategorizedScraper:
                 "price_raw": price_raw,
                 "price_numeric": price_numeric,
                 "currency": currency,
-                "first_seen_at": datetime.utcnow().isoformat(),
-                "last_seen_at": datetime.utcnow().isoformat(),
+                "first_seen_at": utc_now_iso(),
+                "last_seen_at": utc_now_iso(),
                 "seller_id": 1
             }
             
@@ -858,7 +859,7 @@ class UncategorizedScraper:
             print("⚠️ HTML vacío o nulo")
             return
             
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = BeautifulSoup(html, 'lxml')
         
         # Extraer y mostrar título
         title = soup.title.text if soup.title else "Sin título"
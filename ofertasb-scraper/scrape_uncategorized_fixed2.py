@@ -12,43 +12,127 @@ import re
 import sys
 import random
 import argparse
+import asyncio
 import httpx
 import tqdm
 import io
 import hashlib
+import sqlite3
 from typing import Dict, List, Any, Optional
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import lxml.html
 from datetime import datetime
 from supabase import create_client
 from dotenv import load_dotenv
-import uuid
 import base64
 from utils.price import parse_price
+from utils.dates import utc_now_iso
+from utils.rate_limit import RateLimiter
 
 # Cargar variables de entorno
 load_dotenv()
 
 # Constantes
 BASE_URL = "https://www.ofertasb.com"
-SLEEP_MIN = 1.0  # Tiempo mínimo de espera entre solicitudes (segundos)
-SLEEP_MAX = 2.0  # Tiempo máximo de espera entre solicitudes (segundos)
+MAX_REQUESTS_PER_SECOND = 10  # Ritmo máximo de solicitudes contra OfertasB, sumando todas las tareas
+FETCH_ATTEMPTS = 5  # Intentos por página ante errores transitorios
+MAX_BACKOFF = 30.0  # Espera máxima entre reintentos (segundos)
+INSERT_BATCH_SIZE = 500  # Productos por insert a Supabase
+MAX_CONCURRENT_PRODUCTS = 20  # Páginas de producto procesadas en paralelo (una tarea por cada una)
+PRODUCT_QUEUE_SIZE = 1000  # Enlaces de productos en espera; el recorrido del listado se pausa si se llena
+MAX_CONNECTIONS = 64  # Conexiones simultáneas permitidas contra OfertasB
+MAX_KEEPALIVE_CONNECTIONS = 32  # Conexiones ociosas que se conservan para reutilizarlas
+KEEPALIVE_EXPIRY = 30.0  # Segundos que una conexión ociosa sigue abierta
+PAGE_NUMBER_RE = re.compile(r"pagina=(\d+)")  # Número de página en los enlaces del paginador
+ID_PARAM_RE = re.compile(r"id=(\d+)")  # Parámetro id de las categorías
+QUERY_ID_RE = re.compile(r"\?.*id=\d+")  # Enlaces con un id numérico en la query
+PRICE_NUMBER_RE = re.compile(r"[\d\.,]+")  # Parte numérica de un precio
+DIGIT_RE = re.compile(r"\d")  # Textos que contienen algún dígito
+PRICE_TRANSLATION = str.maketrans({".": None, ",": "."})  # "12.500,00" -> "12500.00"
+# Textos que parecen un precio, en orden de preferencia, unidos en una sola alternativa
+# para recorrer el HTML una vez; el número de grupo indica la preferencia
+PRICE_RE = re.compile("|".join(f"({pattern})" for pattern in (
+    r'₡\s?[\d.,]+',  # ₡ seguido de números
+    r'¢\s?[\d.,]+',   # ¢ seguido de números (símbolo alternativo)
+    r'CRC\s?[\d.,]+',  # CRC seguido de números
+    r'colones\s?[\d.,]+',  # "colones" seguido de números
+    r'precio:\s?[\d.,]+',  # "precio:" seguido de números
+    r'precio\s?[\d.,]+',   # "precio" seguido de números
+    r'cuesta\s?[\d.,]+',   # "cuesta" seguido de números
+    r'valor\s?[\d.,]+',    # "valor" seguido de números
+)), re.IGNORECASE)
+# Partes del HTML que se construyen al parsear; el resto del documento se descarta sin crear nodos
+PRODUCT_STRAINER = SoupStrainer(["table", "div", "h1", "h2", "b", "strong", "font", "img", "span", "a", "p", "nav", "ul", "li"])  # Página de producto
+LINK_STRAINER = SoupStrainer("a", href=True)  # Listado: los métodos de respaldo solo miran enlaces
+DETAIL_STRAINER = SoupStrainer("table", id="customers")  # productos_full.asp: solo la tabla del producto
+# lxml rechaza un str con declaración de codificación XML: se le pasan bytes UTF-8 indicando la codificación
+UTF8_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.110 Safari/537.36"
 
 # Carpeta de destino para imágenes en Supabase Storage
 IMAGE_BUCKET = "product-images"  # Nombre del bucket en Supabase Storage
 UNCATEGORIZED_FOLDER = "sin categoria"  # Carpeta específica para productos sin categoría
+IMAGE_MAX_BYTES = 5 * 1024 * 1024  # Imágenes más grandes se omiten sin terminar de descargarlas
+IMAGE_CHUNK_SIZE = 64 * 1024  # Tamaño de cada bloque leído al descargar una imagen
+IMAGE_WORKERS = 12  # Descargas/cargas de imágenes simultáneas por página
+MIN_DIRECT_LINKS = 10  # Con al menos estos enlaces directos no se prueban los métodos de respaldo
+PRODUCT_CACHE_PATH = "product_page_cache.sqlite"  # Páginas de productos con categoría e imágenes ya subidas, entre ejecuciones
+
+
+def _xpath_hrefs(page_html, expression):
+    """Valores href que selecciona una expresión XPath, filtrados en libxml2.
+    Se devuelven como str simples: los "smart strings" de lxml mantienen vivo todo el árbol"""
+    tree = lxml.html.fromstring(page_html.encode("utf-8"), parser=UTF8_HTML_PARSER)
+    return tree.xpath(expression, smart_strings=False)
+
+
+def _normalize_link(href):
+    """Convertir un enlace relativo del sitio en URL absoluta"""
+    if href.startswith("/"):
+        return f"{BASE_URL}{href}"
+    if not href.startswith("http"):
+        return f"{BASE_URL}/{href}"
+    return href
+
+
+def _retry_delay(error, attempt):
+    """Espera antes del siguiente intento: backoff exponencial o el Retry-After de un 429"""
+    backoff = min(2 ** attempt + random.random(), MAX_BACKOFF)
+    response = getattr(error, "response", None) if isinstance(error, httpx.HTTPStatusError) else None
+    if response is not None and response.status_code == 429:
+        try:
+            return min(float(response.headers.get("Retry-After", backoff)), MAX_BACKOFF)
+        except ValueError:
+            # Retry-After también puede venir como fecha HTTP
+            pass
+    return backoff
+
 
 class UncategorizedScraper:
     def __init__(self):
         """Inicializar el scraper y la conexión a Supabase"""
         print("Inicializando scraper...")
         
-        # Inicializar la sesión HTTP con timeout y reintentos
-        self.session = httpx.Client(
+        # Inicializar la sesión HTTP con timeout y reintentos. La misma sesión se usa para
+        # páginas e imágenes, así que se mantienen las conexiones vivas entre productos
+        self.session = httpx.AsyncClient(
             timeout=30.0,
             headers={"User-Agent": USER_AGENT},
-            follow_redirects=True
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            )
         )
+        # Protocolo negociado en la última respuesta; con HTTP/2 las solicitudes
+        # simultáneas comparten una sola conexión TLS
+        self._http_version = None
+        # Espacia las solicitudes de todas las tareas; solo se frena más si el servidor lo pide
+        self._rate_limiter = RateLimiter(MAX_REQUESTS_PER_SECOND)
+        # Limita cuántas imágenes se descargan y suben a la vez
+        self._image_semaphore = asyncio.Semaphore(IMAGE_WORKERS)
         
         # Inicializar conexión a Supabase
         self.setup_supabase()
@@ -56,8 +140,26 @@ class UncategorizedScraper:
         # Mapeo para IDs internos de categorías
         self.category_map = {}
         
-        # Cache de productos existentes para evitar duplicados
-        self.existing_products = {}
+        # IDs externos (numéricos) de los productos existentes para evitar duplicados
+        self.existing_products: set = set()
+        
+        # Productos a la espera del próximo insert por lote
+        self._pending = []
+        
+        # Páginas de productos con categoría vistas en ejecuciones anteriores (ID -> hash del HTML);
+        # si el HTML no cambió, el producto sigue teniendo categoría y no hace falta analizarlo
+        self._product_cache = sqlite3.connect(PRODUCT_CACHE_PATH)
+        self._product_cache.execute(
+            "CREATE TABLE IF NOT EXISTS categorized (product_id INTEGER PRIMARY KEY, body_hash BLOB NOT NULL)"
+        )
+        # Imágenes ya subidas a Storage (sha256 del contenido -> URL pública); muchos productos
+        # comparten la misma imagen y no hace falta subirla otra vez
+        self._product_cache.execute(
+            "CREATE TABLE IF NOT EXISTS images (content_hash TEXT PRIMARY KEY, public_url TEXT NOT NULL)"
+        )
+        # Subidas de esta ejecución (sha256 -> tarea); las imágenes iguales que se descargan
+        # a la vez comparten una sola subida
+        self._image_uploads: Dict[str, asyncio.Task] = {}
         
         # Estadísticas
         self.stats = {
@@ -101,7 +203,7 @@ class UncategorizedScraper:
                     "external_id": "uncategorized",
                     "name": "Sin categoría",
                     "source_url": f"{BASE_URL}/productos_cat.asp",
-                    "last_crawled_at": datetime.utcnow().isoformat(),
+                    "last_crawled_at": utc_now_iso(),
                     "seller_id": 1
                 }
                 
@@ -151,61 +253,73 @@ class UncategorizedScraper:
         try:
             print("Cargando productos existentes...")
             
-            # Implementamos paginación para obtener todos los productos
+            # Paginación por clave: cada página continúa después del último ID de la anterior,
+            # así Postgres no tiene que volver a recorrer las filas ya leídas como con offset
             page_size = 1000
-            current_page = 0
-            all_products = []
-            total_fetched = 0
+            last_id = None
             
             while True:
-                # Calcular offset para esta página
-                offset = current_page * page_size
-                
                 # Consultar esta página de productos
-                result = self.supabase.table("products") \
+                query = self.supabase.table("products") \
                     .select("external_product_id") \
-                    .range(offset, offset + page_size - 1) \
-                    .execute()
+                    .order("external_product_id") \
+                    .limit(page_size)
+                if last_id is not None:
+                    query = query.gt("external_product_id", last_id)
+                result = query.execute()
                 
-                if not result.data or len(result.data) == 0:
+                if not result.data:
                     # No hay más productos, salir del bucle
                     break
                 
-                # Agregar productos a la lista
-                all_products.extend(result.data)
-                total_fetched += len(result.data)
-                print(f"  Cargados {total_fetched} productos hasta ahora...")
+                # Agregar los IDs numéricos de esta página sin acumular las filas
+                self.existing_products.update(
+                    int(product_id) for product_id in (str(product["external_product_id"]) for product in result.data)
+                    if product_id.isdigit()
+                )
+                last_id = result.data[-1]["external_product_id"]
+                print(f"  Cargados {len(self.existing_products)} productos hasta ahora...")
                 
                 # Comprobar si hemos llegado al final
                 if len(result.data) < page_size:
                     break
-                
-                # Avanzar a la siguiente página
-                current_page += 1
-            
-            # Convertir a diccionario para búsqueda rápida
-            self.existing_products = {
-                str(product["external_product_id"]): True 
-                for product in all_products
-            }
             
             print(f"✅ Total de productos existentes cargados: {len(self.existing_products)}")
             return self.existing_products
             
         except Exception as e:
             print(f"❌ Error cargando productos existentes: {str(e)}")
-            return {}
+            return self.existing_products
     
-    def fetch_page(self, url):
+    async def fetch_page(self, url):
         """Obtener el contenido HTML de una página"""
         try:
             print(f"Descargando: {url}")
             
-            # Añadir un retraso aleatorio para evitar detección
-            time.sleep(random.uniform(SLEEP_MIN, SLEEP_MAX))
-            
-            # Hacer la solicitud HTTP
-            response = self.session.get(url)
+            # Hacer la solicitud HTTP, reintentando los errores transitorios
+            for attempt in range(FETCH_ATTEMPTS):
+                try:
+                    await self._rate_limiter.acquire()
+                    response = await self.session.get(url)
+                    response.raise_for_status()
+                    break
+                except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                    # Los 4xx (salvo 429) no se arreglan reintentando
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code != 429 and e.response.status_code < 500:
+                        raise
+                    if attempt == FETCH_ATTEMPTS - 1:
+                        raise
+                    delay = _retry_delay(e, attempt)
+                    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                        # El servidor pide bajar el ritmo: frenar todas las tareas, no solo esta
+                        await self._rate_limiter.pause(delay)
+                    print(f"⚠️ Error transitorio en {url} ({str(e)}), reintentando en {delay:.1f}s...")
+                    await asyncio.sleep(delay)
+            
+            # Avisar solo cuando cambia el protocolo, para confirmar que se negoció HTTP/2
+            if response.http_version != self._http_version:
+                self._http_version = response.http_version
+                print(f"🔌 Protocolo con OfertasB: {response.http_version}")
             
             if response.status_code != 200:
                 print(f"⚠️ Código de estado HTTP inesperado: {response.status_code}")
@@ -223,31 +337,126 @@ class UncategorizedScraper:
             print(f"❌ Error obteniendo la página {url}: {str(e)}")
             return None
     
-    def get_total_pages(self):
+    async def download_image(self, image_url):
+        """Descargar una imagen por bloques, descartándola si supera IMAGE_MAX_BYTES.
+        Devuelve el contenido y su sha256, calculado mientras se descarga"""
+        async with self.session.stream("GET", image_url) as response:
+            if response.status_code != 200:
+                print(f"⚠️ Error descargando imagen, status: {response.status_code}")
+                return None
+
+            # Omitir la descarga si el servidor ya informa un tamaño excesivo
+            content_length = response.headers.get("Content-Length")
+            if content_length and content_length.isdigit() and int(content_length) > IMAGE_MAX_BYTES:
+                print(f"⚠️ Imagen demasiado grande ({content_length} bytes), se omite: {image_url}")
+                return None
+
+            image_data = bytearray()
+            content_hash = hashlib.sha256()
+            async for chunk in response.aiter_bytes(chunk_size=IMAGE_CHUNK_SIZE):
+                image_data.extend(chunk)
+                content_hash.update(chunk)
+                if len(image_data) > IMAGE_MAX_BYTES:
+                    print(f"⚠️ Imagen supera {IMAGE_MAX_BYTES} bytes, se omite: {image_url}")
+                    return None
+
+            return bytes(image_data), content_hash.hexdigest()
+
+    async def store_product_image(self, product_id, image_url):
+        """Descargar la imagen de un producto y subirla a Supabase Storage, devolviendo su URL pública"""
+        try:
+            # Descargar la imagen
+            async with self._image_semaphore:
+                downloaded = await self.download_image(image_url)
+            if not downloaded:
+                return None
+            image_data, content_hash = downloaded
+
+            # Si la misma imagen ya se subió, reutilizar su URL sin volver a subirla
+            cached = self._product_cache.execute(
+                "SELECT public_url FROM images WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if cached:
+                print(f"♻️ Imagen de {product_id} ya estaba en Supabase")
+                return cached[0]
+
+            # El nombre del archivo es el hash del contenido: imágenes iguales van al mismo archivo
+            image_extension = image_url.split('.')[-1] if '.' in image_url else 'jpg'
+            if len(image_extension) > 4 or not image_extension.isalpha():  # Si la extensión es inválida
+                image_extension = 'jpg'
+
+            upload = self._image_uploads.get(content_hash)
+            if upload is None:
+                upload = asyncio.ensure_future(self._upload_image(content_hash, image_data, image_extension))
+                self._image_uploads[content_hash] = upload
+            return await upload
+
+        except Exception as e:
+            print(f"❌ Error procesando imagen de {product_id}: {str(e)}")
+            return None
+
+    async def _upload_image(self, content_hash, image_data, image_extension):
+        """Subir una imagen a Supabase Storage con su hash como nombre y devolver su URL pública"""
+        storage_path = f"{UNCATEGORIZED_FOLDER}/{content_hash}.{image_extension}"
+        try:
+            # Guardar en Supabase Storage (el cliente es síncrono, se sube en un hilo). Con upsert
+            # no falla si el archivo ya existe de una ejecución sin el cache local
+            async with self._image_semaphore:
+                await asyncio.to_thread(
+                    self.supabase.storage.from_(IMAGE_BUCKET).upload,
+                    path=storage_path,
+                    file=image_data,
+                    file_options={"content-type": f"image/{image_extension}", "upsert": "true"}
+                )
+        except Exception as e:
+            print(f"❌ Error subiendo imagen {storage_path}: {str(e)}")
+            # Permitir que otro producto con la misma imagen lo intente de nuevo
+            self._image_uploads.pop(content_hash, None)
+            return None
+
+        # Si llegamos aquí, la carga fue exitosa. Obtener la URL pública
+        public_url = self.supabase.storage.from_(IMAGE_BUCKET).get_public_url(storage_path)
+        self._product_cache.execute(
+            "INSERT OR REPLACE INTO images VALUES (?, ?)", (content_hash, public_url)
+        )
+        print(f"✅ Imagen guardada en Supabase: {storage_path}")
+        return public_url
+
+    async def store_image(self, product):
+        """Subir la imagen de un producto que se va a guardar y apuntar su image_url a Supabase"""
+        if not product.get("image_url"):
+            return
+
+        # IMAGE_WORKERS limita cuántas imágenes se descargan y suben a la vez entre todas las tareas
+        stored_url = await self.store_product_image(product["external_product_id"], product["image_url"])
+        if stored_url:
+            product["image_url"] = stored_url  # Usar URL de Supabase si está disponible
+            self.stats["images_saved"] += 1
+        else:
+            self.stats["image_errors"] += 1
+
+    async def get_total_pages(self):
         """Determinar el número total de páginas a procesar"""
         try:
             print("Determinando el número total de páginas...")
             first_page_url = f"{BASE_URL}/productos_cat.asp"
             
-            html = self.fetch_page(first_page_url)
+            html = await self.fetch_page(first_page_url)
             if not html:
                 return 0
                 
-            soup = BeautifulSoup(html, 'html.parser')
-            
-            # Buscar enlaces de paginación
-            pagination_links = soup.find_all("a", href=lambda href: href and "pagina=" in href)
+            # Buscar enlaces de paginación; XPath filtra los href en libxml2, sin llamar a Python por cada enlace
+            pagination_hrefs = _xpath_hrefs(html, '//a[contains(@href, "pagina=")]/@href')
             
-            if not pagination_links:
+            if not pagination_hrefs:
                 print("⚠️ No se encontraron enlaces de paginación")
                 return 1  # Asumimos que solo hay una página
             
             # Encontrar el número de página más alto
             max_page = 1
             
-            for link in pagination_links:
-                href = link.get("href", "")
-                match = re.search(r"pagina=(\d+)", href)
+            for href in pagination_hrefs:
+                match = PAGE_NUMBER_RE.search(href)
                 if match:
                     page_num = int(match.group(1))
                     if page_num > max_page:
@@ -260,6 +469,50 @@ class UncategorizedScraper:
             print(f"❌ Error detectando número de páginas: {str(e)}")
             return 0
     
+    def _add_fallback_links(self, soup, add, seen):
+        """Métodos 3 a 5 para encontrar enlaces a productos cuando los directos no alcanzan.
+        El método 2 (enlaces dentro de contenedores de producto) se quitó: solo tomaba enlaces a
+        productos_det.asp, que el método 1 ya encuentra"""
+        # Método 3: Enlaces con imágenes de producto
+        img_links = 0
+        for img in soup.find_all("img"):
+            parent_a = img.find_parent("a", href=lambda href: href and "productos_det.asp" in href)
+            if parent_a:
+                add(parent_a.get("href", ""))
+                img_links += 1
+        
+        print(f"Método 3: Encontrados {img_links} enlaces con imágenes de producto")
+        
+        # Método 4: Enlaces con texto o contenido relacionado a productos
+        product_keywords = ["detalle", "producto", "comprar", "ver", "más info", "más información"]
+        potential_product_links = 0
+        
+        for a_tag in soup.find_all("a", href=True):
+            text_content = a_tag.get_text().lower()
+            
+            # Buscar imágenes dentro del enlace
+            has_img = a_tag.find("img") is not None
+            has_keyword = any(keyword in text_content for keyword in product_keywords)
+            
+            if has_img or has_keyword:
+                add(a_tag.get("href", ""))
+                potential_product_links += 1
+        
+        print(f"Método 4: Encontrados {potential_product_links} enlaces potenciales por contenido")
+        
+        # Método 5: Último recurso - cualquier enlace con parámetros de ID
+        if len(seen) < 5:
+            id_links = 0
+            for a_tag in soup.find_all("a", href=lambda href: href and QUERY_ID_RE.search(href)):
+                href = a_tag.get("href", "")
+                # Ignorar enlaces obvios de paginación o categorías
+                if "pagina=" in href and "productos_det.asp" not in href:
+                    continue
+                add(href)
+                id_links += 1
+            
+            print(f"Método 5: Encontrados {id_links} enlaces con parámetros ID")
+    
     def extract_product_links(self, page_html):
         """Extraer links a productos individuales de una página"""
         if not page_html:
@@ -267,8 +520,6 @@ class UncategorizedScraper:
             return []
 
         try:
-            soup = BeautifulSoup(page_html, 'html.parser')
-            
             # Análisis de depuración básico del HTML
             html_size = len(page_html)
             print(f"📊 Tamaño del HTML recibido: {html_size} bytes")
@@ -283,93 +534,28 @@ class UncategorizedScraper:
                 print("💾 Se ha guardado el HTML para análisis")
                 return []
                 
-            # Buscar enlaces a productos de diferentes maneras
-            product_links = []
-            
-            # Método 1: Enlaces directos a productos_det.asp (principal)
-            direct_links = soup.find_all("a", href=lambda href: href and "productos_det.asp" in href)
-            print(f"Método 1: Encontrados {len(direct_links)} enlaces directos a productos_det.asp")
-            
-            for a_tag in direct_links:
-                href = a_tag.get("href", "")
-                if href.startswith("/"):
-                    href = f"{BASE_URL}{href}"
-                elif not href.startswith("http"):
-                    href = f"{BASE_URL}/{href}"
-                product_links.append(href)
-            
-            # Método 2: Enlaces dentro de divs de producto
-            product_containers = soup.select(".product, .item, .product-container, .product-item")
-            print(f"Método 2: Encontrados {len(product_containers)} contenedores de producto")
-            
-            for container in product_containers:
-                links = container.find_all("a", href=True)
-                for link in links:
-                    href = link.get("href", "")
-                    if "productos_det.asp" in href:
-                        if href.startswith("/"):
-                            href = f"{BASE_URL}{href}"
-                        elif not href.startswith("http"):
-                            href = f"{BASE_URL}/{href}"
-                        product_links.append(href)
-            
-            # Método 3: Enlaces con imágenes de producto
-            img_links = []
-            for img in soup.find_all("img"):
-                parent_a = img.find_parent("a", href=lambda href: href and "productos_det.asp" in href)
-                if parent_a:
-                    href = parent_a.get("href", "")
-                    if href.startswith("/"):
-                        href = f"{BASE_URL}{href}"
-                    elif not href.startswith("http"):
-                        href = f"{BASE_URL}/{href}"
-                    img_links.append(href)
-            
-            print(f"Método 3: Encontrados {len(img_links)} enlaces con imágenes de producto")
-            product_links.extend(img_links)
-            
-            # Método 4: Enlaces con texto o contenido relacionado a productos
-            product_keywords = ["detalle", "producto", "comprar", "ver", "más info", "más información"]
-            potential_product_links = []
-            
-            for a_tag in soup.find_all("a", href=True):
-                text_content = a_tag.get_text().lower()
-                
-                # Buscar imágenes dentro del enlace
-                has_img = a_tag.find("img") is not None
-                has_keyword = any(keyword in text_content for keyword in product_keywords)
-                
-                if has_img or has_keyword:
-                    href = a_tag.get("href", "")
-                    if href.startswith("/"):
-                        href = f"{BASE_URL}{href}"
-                    elif not href.startswith("http"):
-                        href = f"{BASE_URL}/{href}"
-                    potential_product_links.append(href)
-            
-            print(f"Método 4: Encontrados {len(potential_product_links)} enlaces potenciales por contenido")
-            product_links.extend(potential_product_links)
-            
-            # Método 5: Último recurso - cualquier enlace con parámetros de ID
-            if len(product_links) < 5:
-                id_links = []
-                for a_tag in soup.find_all("a", href=lambda href: href and re.search(r'\?.*id=\d+', href or "")):
-                    href = a_tag.get("href", "")
-                    # Ignorar enlaces obvios de paginación o categorías
-                    if "pagina=" in href and "productos_det.asp" not in href:
-                        continue
-                        
-                    if href.startswith("/"):
-                        href = f"{BASE_URL}{href}"
-                    elif not href.startswith("http"):
-                        href = f"{BASE_URL}/{href}"
-                    id_links.append(href)
-                
-                print(f"Método 5: Encontrados {len(id_links)} enlaces con parámetros ID")
-                product_links.extend(id_links)
+            # Método 1: Enlaces directos a productos_det.asp (principal). XPath filtra los href en
+            # libxml2; dict.fromkeys normaliza y descarta repetidos conservando el orden
+            direct_hrefs = _xpath_hrefs(page_html, '//a[contains(@href, "productos_det.asp")]/@href')
+            print(f"Método 1: Encontrados {len(direct_hrefs)} enlaces directos a productos_det.asp")
+            
+            product_links = list(dict.fromkeys(_normalize_link(href) for href in direct_hrefs))
+            seen = set(product_links)
+            
+            def add(href):
+                href = _normalize_link(href)
+                if href not in seen:
+                    seen.add(href)
+                    product_links.append(href)
+            
+            # Los demás métodos necesitan el árbol de BeautifulSoup y casi siempre repiten los
+            # mismos enlaces: solo se construye cuando los directos no alcanzan
+            if len(seen) >= MIN_DIRECT_LINKS:
+                print(f"Método 1 encontró {len(seen)} productos, se omiten los métodos de respaldo")
+            else:
+                self._add_fallback_links(BeautifulSoup(page_html, 'lxml', parse_only=LINK_STRAINER), add, seen)
             
-            # Eliminar duplicados
-            unique_links = list(set(product_links))
+            unique_links = product_links
             
             # Imprimir ejemplos para depuración
             if unique_links:
@@ -395,70 +581,61 @@ class UncategorizedScraper:
             traceback.print_exc()
             return []
     
-    def process_product_page(self, url):
+    async def process_product_page(self, url):
         """Procesar la página de un producto individual"""
         try:
             print(f"Procesando producto: {url}")
-            html = self.fetch_page(url)
-            if not html:
-                self.stats["errors"] += 1
-                return None
-                
-            soup = BeautifulSoup(html, 'html.parser')
             
             # Extraer ID del producto
             product_id = None
             if "id=" in url:
                 product_id = url.split("id=")[1].split("&")[0]
             
-            if not product_id:
+            if not product_id or not product_id.isdigit():
                 print(f"⚠️ No se pudo determinar el ID del producto para {url}")
                 self.stats["errors"] += 1
                 return None
             
             # Verificar si ya existe
-            if product_id in self.existing_products:
+            if int(product_id) in self.existing_products:
                 self.stats["existing_products"] += 1
                 print(f"✅ Producto {product_id} ya existe en la base de datos")
                 return None
             
+            # El ID sale de la URL: los productos ya guardados se descartan sin descargar su página
+            html = await self.fetch_page(url)
+            if not html:
+                self.stats["errors"] += 1
+                return None
+            
+            # Si el HTML es idéntico al de una ejecución en la que el producto tenía categoría, no hay nada que analizar
+            body_hash = hashlib.sha1(html.encode('utf-8')).digest()
+            cached = self._product_cache.execute(
+                "SELECT body_hash FROM categorized WHERE product_id = ?", (int(product_id),)
+            ).fetchone()
+            if cached and cached[0] == body_hash:
+                print(f"⏭️ Producto {product_id} sin cambios desde la última ejecución (tiene categoría)")
+                return None
+                
+            soup = BeautifulSoup(html, 'lxml', parse_only=PRODUCT_STRAINER)
+            
             # MEJORA 1: Extracción más precisa del nombre del producto
             name = None
 
-            # Método usado en el scraper original
-            try:
-                # Intentar usar la misma lógica que en el scraper original
-                detail_url = f"{BASE_URL}/productos_full.asp?id={product_id}"
-                detail_html = self.fetch_page(detail_url)
-                if detail_html:
-                    detail_soup = BeautifulSoup(detail_html, 'html.parser')
-                    
-                    # Buscar tablas con contenido de producto
-                    product_tables = detail_soup.find_all("table", id="customers")
-                    for table in product_tables:
-                        name_cell = table.select_one('tr td[colspan="1"]')
-                        if name_cell and name_cell.get_text(strip=True):
-                            name = name_cell.get_text(strip=True)
-                            print(f"Nombre encontrado usando método del scraper original: {name}")
-                            break
-            except Exception as e:
-                print(f"Error intentando extraer nombre con método original: {str(e)}")
-                
-            # Si el método original falló, usar métodos alternativos
-            if not name:
-                # Método 1: Buscar en tablas principales (común en OfertasB)
-                tables = soup.find_all("table")
-                for table in tables:
-                    # Buscar celdas con colspan que suelen contener títulos de productos
-                    name_cells = table.select('tr td[colspan="1"], tr td[colspan="2"], tr td[colspan="3"]')
-                    for cell in name_cells:
-                        text = cell.get_text(strip=True)
-                        if len(text) > 10 and "ofertasb" not in text.lower():
-                            name = text
-                            print(f"Nombre encontrado en celda de tabla: {name}")
-                            break
-                    if name:
+            # Métodos sobre la página ya descargada; productos_full.asp solo se pide si todos fallan
+            # Método 1: Buscar en tablas principales (común en OfertasB)
+            tables = soup.find_all("table")
+            for table in tables:
+                # Buscar celdas con colspan que suelen contener títulos de productos
+                name_cells = table.select('tr td[colspan="1"], tr td[colspan="2"], tr td[colspan="3"]')
+                for cell in name_cells:
+                    text = cell.get_text(strip=True)
+                    if len(text) > 10 and "ofertasb" not in text.lower():
+                        name = text
+                        print(f"Nombre encontrado en celda de tabla: {name}")
                         break
+                if name:
+                    break
             
             # Método 2: Buscar en h1 o h2 principal
             if not name:
@@ -519,6 +696,26 @@ class UncategorizedScraper:
                             print(f"Nombre encontrado tras etiqueta en texto padre: {name}")
                             break
                         
+            # Método 6: el usado en el scraper original, con una segunda descarga de la página
+            if not name:
+                try:
+                    # Intentar usar la misma lógica que en el scraper original
+                    detail_url = f"{BASE_URL}/productos_full.asp?id={product_id}"
+                    detail_html = await self.fetch_page(detail_url)
+                    if detail_html:
+                        detail_soup = BeautifulSoup(detail_html, 'lxml', parse_only=DETAIL_STRAINER)
+                        
+                        # Buscar tablas con contenido de producto
+                        product_tables = detail_soup.find_all("table", id="customers")
+                        for table in product_tables:
+                            name_cell = table.select_one('tr td[colspan="1"]')
+                            if name_cell and name_cell.get_text(strip=True):
+                                name = name_cell.get_text(strip=True)
+                                print(f"Nombre encontrado usando método del scraper original: {name}")
+                                break
+                except Exception as e:
+                    print(f"Error intentando extraer nombre con método original: {str(e)}")
+                
             # Fallback si todavía no se ha encontrado
             if not name:
                 name = f"Producto sin nombre {product_id}"
@@ -534,24 +731,17 @@ class UncategorizedScraper:
             price_numeric = None
             currency = "CRC"  # Por defecto, colones costarricenses
             
-            # Método 1: Buscar patrones de precio con símbolo ₡ directamente en el HTML
-            price_patterns = [
-                r'₡\s?[\d.,]+',  # ₡ seguido de números
-                r'¢\s?[\d.,]+',   # ¢ seguido de números (símbolo alternativo)
-                r'CRC\s?[\d.,]+',  # CRC seguido de números
-                r'colones\s?[\d.,]+',  # "colones" seguido de números
-                r'precio:\s?[\d.,]+',  # "precio:" seguido de números
-                r'precio\s?[\d.,]+',   # "precio" seguido de números
-                r'cuesta\s?[\d.,]+',   # "cuesta" seguido de números
-                r'valor\s?[\d.,]+',    # "valor" seguido de números
-            ]
-            
-            for pattern in price_patterns:
-                match = re.search(pattern, html, re.IGNORECASE)
-                if match:
-                    price_raw = match.group(0).strip()
-                    print(f"Precio encontrado (regex directo): {price_raw}")
-                    break
+            # Método 1: Buscar patrones de precio con símbolo ₡ directamente en el HTML.
+            # Gana el patrón más preferido y, entre iguales, el primero en la página
+            best_match = None
+            for match in PRICE_RE.finditer(html):
+                if best_match is None or match.lastindex < best_match.lastindex:
+                    best_match = match
+                    if match.lastindex == 1:  # Nada supera a un precio con ₡
+                        break
+            if best_match:
+                price_raw = best_match.group(0).strip()
+                print(f"Precio encontrado (regex directo): {price_raw}")
                     
             # Método 2: Buscar en elementos específicos si no se encontró con regex
             if not price_raw:
@@ -565,7 +755,7 @@ class UncategorizedScraper:
                     if price_elem:
                         price_text = price_elem.text.strip()
                         # Verificar que contiene dígitos
-                        if re.search(r'\d', price_text):
+                        if DIGIT_RE.search(price_text):
                             price_raw = price_text
                             print(f"Precio encontrado ({selector}): {price_raw}")
                             break
@@ -578,7 +768,7 @@ class UncategorizedScraper:
                     # Buscar texto adyacente
                     if parent.next_sibling and isinstance(parent.next_sibling, str):
                         text = parent.next_sibling.strip()
-                        if re.search(r'\d', text):
+                        if DIGIT_RE.search(text):
                             price_raw = text
                             print(f"Precio encontrado en texto adyacente: {price_raw}")
                             break
@@ -589,7 +779,7 @@ class UncategorizedScraper:
                     
                     if next_elem and hasattr(next_elem, 'text'):
                         text = next_elem.text.strip()
-                        if re.search(r'\d', text):
+                        if DIGIT_RE.search(text):
                             price_raw = text
                             print(f"Precio encontrado en elemento adyacente: {price_raw}")
                             break
@@ -601,7 +791,7 @@ class UncategorizedScraper:
                     next_cell = price_label.find_next_sibling("td")
                     if next_cell:
                         price_text = next_cell.text.strip()
-                        if re.search(r'\d', price_text):
+                        if DIGIT_RE.search(price_text):
                             price_raw = price_text
                             print(f"Precio encontrado en tabla: {price_raw}")
             
@@ -609,7 +799,7 @@ class UncategorizedScraper:
             if price_raw:
                 try:
                     # Añadir el símbolo ₡ si no lo tiene pero contiene números
-                    if not any(symbol in price_raw for symbol in ['₡', '¢', '$']) and re.search(r'\d', price_raw):
+                    if not any(symbol in price_raw for symbol in ['₡', '¢', '$']) and DIGIT_RE.search(price_raw):
                         price_raw = f"₡{price_raw}"
                         print(f"Agregado símbolo ₡ al precio: {price_raw}")
                     
@@ -619,9 +809,9 @@ class UncategorizedScraper:
                     
                 except ValueError:
                     # Si falla, intentar extracción directa
-                    price_match = re.search(r'[\d\.,]+', price_raw)
+                    price_match = PRICE_NUMBER_RE.search(price_raw)
                     if price_match:
-                        price_str = price_match.group(0).replace(".", "").replace(",", ".")
+                        price_str = price_match.group(0).translate(PRICE_TRANSLATION)
                         try:
                             price_numeric = float(price_str)
                             print(f"Precio numérico extraído manualmente: {price_numeric}")
@@ -643,7 +833,6 @@ class UncategorizedScraper:
             
             # MEJORA 3: Mejor extracción y almacenamiento de imágenes en carpeta específica
             image_url = None
-            image_stored_url = None
             
             # Método 1: Buscar en div#content
             main_content = soup.find('div', {'id': 'content'})
@@ -686,54 +875,8 @@ class UncategorizedScraper:
                 elif not image_url.startswith('http'):
                     image_url = f"{BASE_URL}/{image_url}"
                 print(f"URL de imagen normalizada: {image_url}")
-                
-                # Descargar y guardar la imagen en Supabase Storage en carpeta específica
-                try:
-                    # Descargar la imagen
-                    response = self.session.get(image_url)
-                    if response.status_code == 200:
-                        # Generar nombre de archivo único
-                        image_extension = image_url.split('.')[-1] if '.' in image_url else 'jpg'
-                        if len(image_extension) > 4 or not image_extension.isalpha():  # Si la extensión es inválida
-                            image_extension = 'jpg'
-                            
-                        filename = f"{product_id}_{uuid.uuid4().hex[:8]}.{image_extension}"
-                        storage_path = f"{UNCATEGORIZED_FOLDER}/{filename}"
-                        
-                        # Guardar en Supabase Storage
-                        image_data = response.content
-                        
-                        try:
-                            # Intentar subir la imagen
-                            result = self.supabase.storage.from_(IMAGE_BUCKET).upload(
-                                path=storage_path,
-                                file=image_data,
-                                file_options={"content-type": f"image/{image_extension}"}
-                            )
-                            
-                            # Si llegamos aquí, la carga fue exitosa
-                            # Obtener la URL pública
-                            try:
-                                public_url = self.supabase.storage.from_(IMAGE_BUCKET).get_public_url(storage_path)
-                                print(f"✅ Imagen guardada en Supabase: {storage_path}")
-                                print(f"URL pública: {public_url}")
-                                image_stored_url = public_url
-                                self.stats["images_saved"] += 1
-                            except Exception as url_error:
-                                print(f"⚠️ Error obteniendo URL pública: {str(url_error)}")
-                                self.stats["image_errors"] += 1
-                                
-                        except Exception as upload_error:
-                            print(f"⚠️ Error durante la carga: {str(upload_error)}")
-                            self.stats["image_errors"] += 1
-                    else:
-                        print(f"⚠️ Error descargando imagen, status: {response.status_code}")
-                        self.stats["image_errors"] += 1
-                        
-                except Exception as e:
-                    print(f"❌ Error procesando imagen: {str(e)}")
-                    self.stats["image_errors"] += 1
-            
+
+                # La imagen se descarga y se sube después, solo si el producto se va a guardar            
             # VERIFICACIÓN DE CATEGORÍA - PARTE CRÍTICA
             is_uncategorized = False
             category_id = None
@@ -758,7 +901,7 @@ class UncategorizedScraper:
                     category_link = category_value.find("a", href=lambda href: href and "productos_cat.asp" in href)
                     if category_link:
                         href = category_link.get("href", "")
-                        match = re.search(r"id=(\d+)", href)
+                        match = ID_PARAM_RE.search(href)
                         if match:
                             category_id = match.group(1)
                             print(f"ID de categoría extraído de la URL: {category_id}")
@@ -791,7 +934,7 @@ class UncategorizedScraper:
                     for link in links:
                         href = link.get("href", "")
                         if "categoria" in href.lower() or "productos_cat.asp" in href.lower():
-                            match = re.search(r"id=(\d+)", href)
+                            match = ID_PARAM_RE.search(href)
                             if match:
                                 category_id = match.group(1)
                                 category_name = link.text.strip()
@@ -821,12 +964,12 @@ class UncategorizedScraper:
                 "external_product_id": product_id,
                 "name": name,
                 "product_url": url,
-                "image_url": image_stored_url or image_url,  # Usar URL de Supabase si está disponible
+                "image_url": image_url,  # Se reemplaza por la URL de Supabase en store_image
                 "price_raw": price_raw,
                 "price_numeric": price_numeric,
                 "currency": currency,
-                "first_seen_at": datetime.utcnow().isoformat(),
-                "last_seen_at": datetime.utcnow().isoformat(),
+                "first_seen_at": utc_now_iso(),
+                "last_seen_at": utc_now_iso(),
                 "seller_id": 1,
                 "source_html_hash": hashlib.md5(html.encode('utf-8')).hexdigest()
             }
@@ -848,6 +991,9 @@ class UncategorizedScraper:
             elif category_id and category_id in self.category_map:
                 # Este producto tiene una categoría válida, lo ignoramos para este scraper específico
                 print(f"⏭️ Producto {product_id} tiene categoría asignada: {self.category_map[category_id]['name']}")
+                self._product_cache.execute(
+                    "INSERT OR REPLACE INTO categorized VALUES (?, ?)", (int(product_id), body_hash)
+                )
                 return None
             else:
                 # No pudimos determinar si es sin categoría o no, por lo tanto lo consideramos sin categoría
@@ -869,29 +1015,48 @@ class UncategorizedScraper:
             return None
     
     def save_product(self, product_data):
-        """Guardar un producto en Supabase"""
+        """Encolar un producto para guardarlo en Supabase en el próximo lote"""
         if not product_data:
             return False
             
+        # Quitar el HTML completo para el insert (lo guardamos separado)
+        product_data.pop("source_html", None)
+        
+        # Marcarlo como existente desde ya para no procesarlo otra vez antes del insert
+        self.existing_products.add(int(product_data["external_product_id"]))
+        self._pending.append(product_data)
+        
+        if len(self._pending) >= INSERT_BATCH_SIZE:
+            self.flush()
+        return True
+    
+    def flush(self):
+        """Insertar en Supabase los productos pendientes con una sola solicitud"""
+        # Confirmar también los hashes e imágenes del cache local: si la ejecución se corta,
+        # la siguiente no vuelve a analizar esas páginas ni a subir esas imágenes
+        self._product_cache.commit()
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        
         try:
-            # Quitar el HTML completo para el upsert (lo guardamos separado)
-            html_content = product_data.pop("source_html", None)
-            
-            # Insertar el producto
-            result = self.supabase.table("products").insert(product_data).execute()
-            
-            if not result.data:
-                print(f"❌ Error guardando producto {product_data.get('external_product_id')}")
-                return False
-                
-            # Marcar como existente en nuestro cache
-            self.existing_products[product_data["external_product_id"]] = True
-            
-            return True
-            
+            result = self.supabase.table("products").insert(batch).execute()
+            print(f"💾 Lote de {len(result.data or [])} productos guardado")
+            return
         except Exception as e:
-            print(f"❌ Error guardando producto {product_data.get('external_product_id')}: {str(e)}")
-            return False
+            # Un producto inválido hace fallar todo el lote: reintentar uno por uno
+            print(f"⚠️ Error en el insert por lote de {len(batch)} productos: {str(e)}. Reintentando uno por uno...")
+        
+        for product_data in batch:
+            try:
+                result = self.supabase.table("products").insert(product_data).execute()
+                if result.data:
+                    continue
+                print(f"❌ Error guardando producto {product_data.get('external_product_id')}")
+            except Exception as e:
+                print(f"❌ Error guardando producto {product_data.get('external_product_id')}: {str(e)}")
+            # No quedó guardado: permitir procesarlo de nuevo
+            self.existing_products.discard(int(product_data["external_product_id"]))
     
     def debug_page_content(self, html):
         """Mostrar información de depuración sobre el contenido de la página"""
@@ -899,7 +1064,7 @@ class UncategorizedScraper:
             print("⚠️ HTML vacío o nulo")
             return
             
-        soup = BeautifulSoup(html, 'html.parser')
+        soup = BeautifulSoup(html, 'lxml')
         
         # Extraer y mostrar título
         title = soup.title.text if soup.title else "Sin título"
@@ -926,7 +1091,90 @@ class UncategorizedScraper:
             if indicator in html.lower():
                 print(f"⚠️ Posible problema detectado: '{indicator}'")
     
-    def run(self, page_limit=None, start_page=1, debug_mode=False):
+    async def close(self):
+        """Cerrar la sesión y liberar recursos"""
+        await self.session.aclose()
+        self._product_cache.commit()
+        self._product_cache.close()
+    
+    async def _produce_product_links(self, queue, start_page, end_page, page_progress, debug_mode):
+        """Recorrer las páginas del listado y encolar los enlaces de sus productos"""
+        # Variables de control para detección de problemas
+        consecutive_empty_pages = 0
+        max_consecutive_empty = 5  # Detener después de 5 páginas consecutivas sin productos
+        
+        # Procesar cada página
+        for page_num in range(start_page, end_page + 1):
+            page_url = f"{BASE_URL}/productos_cat.asp?pagina={page_num}"
+            print(f"\n{'='*40}")
+            print(f"🌐 PÁGINA {page_num}/{end_page}: {page_url}")
+            print(f"{'='*40}")
+            
+            page_html = await self.fetch_page(page_url)
+            if not page_html:
+                page_progress.update(1)
+                consecutive_empty_pages += 1
+                print(f"⚠️ Página {page_num} sin contenido ({consecutive_empty_pages} consecutivas)")
+                
+                if consecutive_empty_pages >= max_consecutive_empty:
+                    print(f"⛔ {max_consecutive_empty} páginas consecutivas sin contenido. Finalizando.")
+                    return
+                    
+                continue
+            
+            # Análisis previo del HTML
+            if debug_mode:
+                print("\n🔬 Análisis previo del HTML de la página:")
+                self.debug_page_content(page_html)
+            
+            # Extraer links a productos
+            product_links = self.extract_product_links(page_html)
+            
+            if product_links:
+                consecutive_empty_pages = 0  # Reiniciar contador si encontramos productos
+                print(f"✅ Encontrados {len(product_links)} productos en página {page_num}")
+            else:
+                consecutive_empty_pages += 1
+                print(f"⚠️ No se encontraron productos en página {page_num} ({consecutive_empty_pages} consecutivas)")
+                
+                # Si tenemos demasiadas páginas consecutivas sin productos, algo puede estar mal
+                if consecutive_empty_pages >= max_consecutive_empty:
+                    print(f"⛔ {max_consecutive_empty} páginas consecutivas sin productos. Finalizando.")
+                    
+                    # Guardar última página para análisis
+                    with open(f"debug_empty_page_{page_num}.html", 'w', encoding='utf-8') as f:
+                        f.write(page_html)
+                    print(f"💾 Guardada página vacía para análisis: debug_empty_page_{page_num}.html")
+                    
+                    return
+            
+            # Entregar los productos a las tareas que los procesan; espera si la cola está llena
+            for product_url in product_links:
+                await queue.put(product_url)
+            
+            # Las páginas con categoría casi nunca llenan un lote: confirmar el cache una vez por página
+            self._product_cache.commit()
+            page_progress.update(1)
+    
+    async def _consume_products(self, queue, product_progress):
+        """Procesar los productos de la cola y guardar los que no tienen categoría"""
+        while True:
+            product_url = await queue.get()
+            try:
+                product_data = await self.process_product_page(product_url)
+                if product_data:
+                    # Subir la imagen y luego guardar el producto
+                    await self.store_image(product_data)
+                    self.save_product(product_data)
+            except Exception as e:
+                # Un error inesperado no debe detener esta tarea: la cola quedaría sin vaciar
+                print(f"❌ Error procesando producto {product_url}: {str(e)}")
+                self.stats["errors"] += 1
+            finally:
+                product_progress.update(1)
+                queue.task_done()
+    
+    async def run(self, page_limit=None, start_page=1, debug_mode=False):
         """Ejecutar el scraper completo
         
         Args:
@@ -951,7 +1199,7 @@ class UncategorizedScraper:
             self.load_existing_products()
             
             # Obtener el número total de páginas
-            total_pages = self.get_total_pages()
+            total_pages = await self.get_total_pages()
             if total_pages == 0:
                 print("❌ No se pudieron detectar las páginas. Abortando.")
                 return
@@ -967,81 +1215,25 @@ class UncategorizedScraper:
             
             print(f"\n🚀 Procesando {total_pages_to_process} páginas (de {start_page} a {end_page})")
             
-            # Configurar barra de progreso para las páginas
+            # Configurar barras de progreso para las páginas y los productos
             page_progress = tqdm.tqdm(total=total_pages_to_process, desc="Procesando páginas", unit="página")
+            product_progress = tqdm.tqdm(desc="Procesando productos", unit="producto")
             
-            # Variables de control para detección de problemas
-            consecutive_empty_pages = 0
-            max_consecutive_empty = 5  # Detener después de 5 páginas consecutivas sin productos
-            
-            # Procesar cada página
-            for page_num in range(start_page, end_page + 1):
-                page_url = f"{BASE_URL}/productos_cat.asp?pagina={page_num}"
-                print(f"\n{'='*40}")
-                print(f"🌐 PÁGINA {page_num}/{end_page}: {page_url}")
-                print(f"{'='*40}")
-                
-                page_html = self.fetch_page(page_url)
-                if not page_html:
-                    page_progress.update(1)
-                    consecutive_empty_pages += 1
-                    print(f"⚠️ Página {page_num} sin contenido ({consecutive_empty_pages} consecutivas)")
-                    
-                    if consecutive_empty_pages >= max_consecutive_empty:
-                        print(f"⛔ {max_consecutive_empty} páginas consecutivas sin contenido. Finalizando.")
-                        break
-                        
-                    continue
-                
-                # Análisis previo del HTML
-                if debug_mode:
-                    print("\n🔬 Análisis previo del HTML de la página:")
-                    self.debug_page_content(page_html)
-                
-                # Extraer links a productos
-                product_links = self.extract_product_links(page_html)
-                
-                if product_links:
-                    consecutive_empty_pages = 0  # Reiniciar contador si encontramos productos
-                    print(f"✅ Encontrados {len(product_links)} productos en página {page_num}")
-                else:
-                    consecutive_empty_pages += 1
-                    print(f"⚠️ No se encontraron productos en página {page_num} ({consecutive_empty_pages} consecutivas)")
-                    
-                    # Si tenemos demasiadas páginas consecutivas sin productos, algo puede estar mal
-                    if consecutive_empty_pages >= max_consecutive_empty:
-                        print(f"⛔ {max_consecutive_empty} páginas consecutivas sin productos. Finalizando.")
-                        
-                        # Guardar última página para análisis
-                        with open(f"debug_empty_page_{page_num}.html", 'w', encoding='utf-8') as f:
-                            f.write(page_html)
-                        print(f"💾 Guardada página vacía para análisis: debug_empty_page_{page_num}.html")
-                        
-                        break
-                
-                # Procesar cada producto
-                if product_links:
-                    product_progress = tqdm.tqdm(total=len(product_links), desc=f"Productos en página {page_num}", unit="producto")
-                    uncategorized_in_page = 0
-                    
-                    for product_url in product_links:
-                        # Procesar producto
-                        product_data = self.process_product_page(product_url)
-                        
-                        # Guardar si es válido (sin categoría)
-                        if product_data:
-                            self.save_product(product_data)
-                            uncategorized_in_page += 1
-                        
-                        product_progress.update(1)
-                    
-                    product_progress.close()
-                    print(f"📊 Resumen de la página {page_num}: {uncategorized_in_page} productos sin categoría de {len(product_links)} totales")
-                
-                page_progress.update(1)
-                
-                # Pequeña pausa entre páginas para evitar sobrecargar el servidor
-                time.sleep(random.uniform(1.5, 3.0))
+            # El listado se recorre mientras los productos ya encontrados se procesan en paralelo
+            queue = asyncio.Queue(maxsize=PRODUCT_QUEUE_SIZE)
+            consumers = [
+                asyncio.create_task(self._consume_products(queue, product_progress))
+                for _ in range(MAX_CONCURRENT_PRODUCTS)
+            ]
+            try:
+                await self._produce_product_links(queue, start_page, end_page, page_progress, debug_mode)
+                # Esperar a que se procesen los productos que quedan en la cola
+                await queue.join()
+            finally:
+                for consumer in consumers:
+                    consumer.cancel()
+                await asyncio.gather(*consumers, return_exceptions=True)
+                product_progress.close()
             
             page_progress.close()
             
@@ -1064,7 +1256,8 @@ class UncategorizedScraper:
             print(f"⏱️ Duración total: {int(hours)}h {int(minutes)}m {int(seconds)}s")
             print("="*50)
             
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            # Con asyncio.run, Ctrl+C llega a esta corrutina como cancelación
             print("\n\n⛔ Ejecución interrumpida por el usuario")
             
             # Duración hasta interrupción
@@ -1090,6 +1283,19 @@ class UncategorizedScraper:
             print(f"\n❌ Error durante la ejecución: {str(e)}")
             import traceback
             traceback.print_exc()
+        
+        finally:
+            # Guardar los productos que quedaron en el último lote, también si se interrumpió
+            self.flush()
+
+
+async def main(args):
+    """Crear el scraper, ejecutarlo y cerrar la sesión al terminar"""
+    scraper = UncategorizedScraper()
+    try:
+        await scraper.run(page_limit=args.limit, start_page=args.start, debug_mode=args.debug)
+    finally:
+        await scraper.close()
 
 
 if __name__ == "__main__":
@@ -1101,5 +1307,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
     
     # Crear e iniciar el scraper
-    scraper = UncategorizedScraper()
-    scraper.run(page_limit=args.limit, start_page=args.start, debug_mode=args.debug)
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        # Las estadísticas parciales ya se mostraron en run()
+        pass
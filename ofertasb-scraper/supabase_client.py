@@ -1,12 +1,15 @@
-from datetime import datetime
 import os
-from typing import Dict, Any
+import logging
+from typing import Dict, Any, List
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from utils.dates import utc_now_iso
 
 # Cargar variables de entorno desde el archivo .env
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 class SupabaseClient:
     def __init__(self):
         url = os.getenv("SUPABASE_URL")
@@ -60,7 +63,7 @@ class SupabaseClient:
             "external_id": category_data["external_id"],
             "name": category_data["name"],
             "source_url": category_data["source_url"],
-            "last_crawled_at": datetime.utcnow().isoformat(),
+            "last_crawled_at": utc_now_iso(),
             "seller_id": 1  # ID fijo para OfertasB
         }
         
@@ -77,6 +80,56 @@ class SupabaseClient:
         
         return result.data[0] if result.data else None
 
+    def finalize_category(self, external_id: str, product_count: int) -> Dict[str, Any]:
+        """
+        Store the final product count of an already existing category in a single update
+        """
+        result = self.client.table("categories").update({
+            "product_count": product_count,
+            "last_crawled_at": utc_now_iso()
+        }).eq("external_id", external_id).execute()
+        
+        return result.data[0] if result.data else None
+
+    def _build_product_row(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the products row for an upsert, casting every field to the type the table expects
+        """
+        # Preparar los datos del producto asegurándonos de que son del tipo correcto
+        product = {
+            "category_id": int(product_data["category_id"]), # Esto es el ID interno de la categoría en Supabase
+            "external_product_id": str(product_data["external_product_id"]),
+            "seller_id": 1,  # ID fijo para OfertasB
+            "name": str(product_data["name"]),
+            "product_url": str(product_data["product_url"]),
+            "image_url": str(product_data["image_url"]),
+            "price_raw": str(product_data["price_raw"]),
+            "price_numeric": float(product_data["price_numeric"]),
+            "currency": "CRC",
+            "last_seen_at": utc_now_iso(),
+            "source_html_hash": str(product_data["source_html_hash"])
+        }
+        
+        # Si hay una URL de archivo de imagen, asegurarnos de que es string
+        if "image_file_url" in product_data:
+            if product_data["image_file_url"]:
+                product["image_file_url"] = str(product_data["image_file_url"])
+                log.debug("Setting image_file_url for product %s: %s", product_data['external_product_id'], product['image_file_url'])
+            else:
+                log.debug("image_file_url is None for product %s", product_data['external_product_id'])
+        else:
+            log.debug("No image_file_url in product_data for %s", product_data['external_product_id'])
+        
+        # Agregar campos adicionales si existen, asegurando que son strings
+        if "estado" in product_data:
+            product["estado"] = str(product_data["estado"])
+        if "peso" in product_data:
+            product["peso"] = str(product_data["peso"])
+        if "categoria_full" in product_data:
+            product["categoria_full"] = str(product_data["categoria_full"])
+
+        return product
+
     def upsert_product(self, product_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Upsert a product and return the result.
@@ -85,38 +138,7 @@ class SupabaseClient:
         try:
             print(f"\nIntentando upsert del producto {product_data.get('external_product_id')}...")
             
-            # Preparar los datos del producto asegurándonos de que son del tipo correcto
-            product = {
-                "category_id": int(product_data["category_id"]), # Esto es el ID interno de la categoría en Supabase
-                "external_product_id": str(product_data["external_product_id"]),
-                "seller_id": 1,  # ID fijo para OfertasB
-                "name": str(product_data["name"]),
-                "product_url": str(product_data["product_url"]),
-                "image_url": str(product_data["image_url"]),
-                "price_raw": str(product_data["price_raw"]),
-                "price_numeric": float(product_data["price_numeric"]),
-                "currency": "CRC",
-                "last_seen_at": datetime.utcnow().isoformat(),
-                "source_html_hash": str(product_data["source_html_hash"])
-            }
-            
-            # Si hay una URL de archivo de imagen, asegurarnos de que es string
-            if "image_file_url" in product_data:
-                if product_data["image_file_url"]:
-                    product["image_file_url"] = str(product_data["image_file_url"])
-                    print(f"Setting image_file_url for product {product_data['external_product_id']}: {product['image_file_url']}")
-                else:
-                    print(f"Warning: image_file_url is None for product {product_data['external_product_id']}")
-            else:
-                print(f"Warning: No image_file_url in product_data for {product_data['external_product_id']}")
-            
-            # Agregar campos adicionales si existen, asegurando que son strings
-            if "estado" in product_data:
-                product["estado"] = str(product_data["estado"])
-            if "peso" in product_data:
-                product["peso"] = str(product_data["peso"])
-            if "categoria_full" in product_data:
-                product["categoria_full"] = str(product_data["categoria_full"])
+            product = self._build_product_row(product_data)
             
             print("Datos del producto preparados correctamente")
             
@@ -145,6 +167,45 @@ class SupabaseClient:
         
         return result.data[0] if result.data else None
 
+    def upsert_products_batch(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Upsert several products with one request per column set and return the saved rows.
+        If a batch is rejected, its products are retried one by one so a single bad row
+        does not discard the rest.
+        """
+        # PostgREST exige que todas las filas de un lote tengan las mismas columnas
+        batches: Dict[tuple, List[Dict[str, Any]]] = {}
+        for product_data in products:
+            try:
+                row = self._build_product_row(product_data)
+            except Exception as e:
+                print(f"Error preparando el producto {product_data.get('external_product_id', 'unknown')}: {str(e)}")
+                continue
+            batches.setdefault(tuple(sorted(row)), []).append(row)
+
+        saved = []
+        for rows in batches.values():
+            try:
+                result = self.client.table("products").upsert(
+                    rows,
+                    on_conflict="external_product_id"
+                ).execute()
+                saved.extend(result.data or [])
+                print(f"Lote de {len(rows)} productos guardado exitosamente")
+            except Exception as e:
+                print(f"Error en el upsert por lote de {len(rows)} productos: {str(e)}. Reintentando uno por uno...")
+                for row in rows:
+                    try:
+                        result = self.client.table("products").upsert(
+                            row,
+                            on_conflict="external_product_id"
+                        ).execute()
+                        saved.extend(result.data or [])
+                    except Exception as row_error:
+                        print(f"Error al hacer upsert del producto {row['external_product_id']}: {str(row_error)}")
+
+        return saved
+
     def upload_product_image(self, category_id: str, product_id: str, image_data: bytes) -> str:
         """
         Upload a product image to storage and return the public URL
@@ -0,0 +1,11 @@
+from datetime import datetime, timezone
+
+_utc_now = datetime.now
+_UTC = timezone.utc
+
+
+def utc_now_iso() -> str:
+    """
+    Current UTC time as a timezone-aware ISO 8601 string, e.g. for last_seen_at columns.
+    """
+    return _utc_now(_UTC).isoformat()
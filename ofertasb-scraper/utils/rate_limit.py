@@ -0,0 +1,25 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Espacia las solicitudes a un ritmo máximo sin dormir cuando el intervalo ya pasó."""
+
+    def __init__(self, rps: float):
+        self.min_interval = 1 / rps
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Reservar el próximo turno bajo el lock y esperar fuera de él
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def pause(self, seconds: float):
+        """Retrasa los próximos turnos de todas las tareas, p. ej. ante un 429 del servidor."""
+        async with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)